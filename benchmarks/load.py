@@ -0,0 +1,250 @@
+"""
+HTTP Load Test
+
+Seeds the database with Promotions and then drives a mixed workload of
+list (with filters), get, create, update and activate/deactivate requests
+through the REST API from several threads. The request rate and the
+latency percentiles of each operation are written to a JSON file that can
+be diffed between commits.
+
+Run it in-process against the database in DATABASE_URI with:
+    DATABASE_URI=sqlite:////tmp/load.db python -m benchmarks.load --seed 1000 --requests 5000
+
+or against a running service with:
+    python -m benchmarks.load --url http://localhost:8080 --api-key $API_KEY
+
+The same --random-seed sends the same sequence of requests every time.
+"""
+import json
+import math
+import time
+import random
+import argparse
+import platform
+import subprocess
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+# Values of the generated Promotions, like tests.factories.PromotionFactory but
+# drawn from the seeded random generator so every run sends the same data
+CATEGORIES = ["holiday", "friends_and_family", "seasonal"]
+PROMOTYPES = ["BUYONEGETONEFREE", "GET20PERCENTOFF", "UNKNOWN"]
+
+# Share of each operation in the workload, override with --mix
+DEFAULT_MIX = {"list": 40, "get": 35, "create": 5, "update": 10, "activate": 5, "deactivate": 5}
+
+# Largest number of Promotions sent in one batch while seeding
+SEED_BATCH_SIZE = 1000
+
+
+######################################################################
+# Ways of sending requests
+######################################################################
+class LocalClient:  # pylint: disable=too-few-public-methods
+    """Sends requests to the app in this process through the Flask test client"""
+
+    def __init__(self):
+        from service import app, create_app  # pylint: disable=import-outside-toplevel
+
+        app.config["DB_CREATE_TABLES"] = True
+        self.app = create_app()
+        self.api_key = app.config["API_KEY"]
+        self.target = f"in-process {app.config['SQLALCHEMY_DATABASE_URI'].split(':', 1)[0]}"
+
+    def session(self):
+        """Returns a client for one thread"""
+        client = self.app.test_client()
+
+        def send(method, path, body=None, params=None):
+            response = client.open(path, method=method, json=body, query_string=params,
+                                   headers={"X-Api-Key": self.api_key})
+            return response.status_code, response.get_json(silent=True)
+
+        return send
+
+
+class RemoteClient:  # pylint: disable=too-few-public-methods
+    """Sends requests to a running service over HTTP"""
+
+    def __init__(self, url: str, api_key: str):
+        self.url = url.rstrip("/")
+        self.api_key = api_key
+        self.target = self.url
+
+    def session(self):
+        """Returns a client for one thread"""
+        import requests  # pylint: disable=import-outside-toplevel
+
+        http = requests.Session()
+        http.headers["X-Api-Key"] = self.api_key or ""
+
+        def send(method, path, body=None, params=None):
+            response = http.request(method, self.url + path, json=body, params=params, timeout=30)
+            try:
+                return response.status_code, response.json()
+            except ValueError:
+                return response.status_code, None
+
+        return send
+
+
+######################################################################
+# The workload
+######################################################################
+def make_promotion(rng: random.Random) -> dict:
+    """Returns the body of a new Promotion"""
+    return {
+        "name": f"promotion-{rng.randrange(1000000)}",
+        "category": rng.choice(CATEGORIES),
+        "available": rng.random() < 0.5,
+        "promotype": rng.choice(PROMOTYPES),
+    }
+
+
+def seed(send, count: int, rng: random.Random) -> list:
+    """Creates count Promotions with the batch endpoint and returns their ids"""
+    ids = []
+    while len(ids) < count:
+        batch = [make_promotion(rng) for _ in range(min(SEED_BATCH_SIZE, count - len(ids)))]
+        code, data = send("POST", "/api/promotions:batch", batch)
+        if code != 201:
+            raise RuntimeError(f"Seeding failed with {code}: {data}")
+        ids.extend(int(result["id"]) for result in data["results"])
+    return ids
+
+
+def plan(mix: dict, count: int, ids: list, rng: random.Random) -> list:
+    """Returns the (operation, method, path, body, params) of every request in order"""
+    operations = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    requests = []
+    for operation in operations:
+        promotion_id = rng.choice(ids)
+        if operation == "list":
+            params = {"category": rng.choice(CATEGORIES), "available": "true", "limit": 50}
+            requests.append((operation, "GET", "/api/promotions", None, params))
+        elif operation == "get":
+            requests.append((operation, "GET", f"/api/promotions/{promotion_id}", None, None))
+        elif operation == "create":
+            requests.append((operation, "POST", "/api/promotions", make_promotion(rng), None))
+        elif operation == "update":
+            requests.append((operation, "PUT", f"/api/promotions/{promotion_id}", make_promotion(rng), None))
+        else:
+            requests.append((operation, "PUT", f"/api/promotions/{promotion_id}/{operation}", None, None))
+    return requests
+
+
+def run(client, requests: list, concurrency: int) -> tuple:
+    """Sends the requests from several threads and returns the timings and the elapsed time"""
+    timings = {}
+
+    def worker(share):
+        send = client.session()
+        results = []
+        for operation, method, path, body, params in share:
+            start = time.perf_counter()
+            code, _ = send(method, path, body, params)
+            results.append((operation, time.perf_counter() - start, code < 400))
+        return results
+
+    shares = [requests[index::concurrency] for index in range(concurrency)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for results in executor.map(worker, shares):
+            for operation, elapsed, ok in results:
+                timings.setdefault(operation, []).append((elapsed, ok))
+    return timings, time.perf_counter() - start
+
+
+######################################################################
+# The report
+######################################################################
+def percentile(ordered: list, share: float) -> float:
+    """Returns the nearest rank percentile of a sorted list"""
+    # round away float noise first, 0.9 * 10 is 9.000000000000002
+    rank = max(math.ceil(round(share * len(ordered), 9)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def summarize(timings: list, elapsed: float) -> dict:
+    """Returns the request rate, errors and latency percentiles in milliseconds"""
+    latencies = sorted(timing for timing, _ in timings)
+    return {
+        "requests": len(latencies),
+        "errors": sum(1 for _, ok in timings if not ok),
+        "rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(sum(latencies) / len(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p90_ms": round(percentile(latencies, 0.90) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+        "max_ms": round(latencies[-1] * 1000, 3),
+    }
+
+
+def git_commit():
+    """Returns the commit being measured, or None outside of a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(text: str) -> dict:
+    """Parses a mix like list=40,get=40,update=20"""
+    mix = {}
+    for item in text.split(","):
+        operation, _, weight = item.partition("=")
+        if operation not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"Unknown operation: {operation}")
+        mix[operation] = float(weight)
+    return mix
+
+
+def main():
+    """Seeds the database, runs the workload and writes the report"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="base URL of a running service, in-process when not given")
+    parser.add_argument("--api-key", help="API key of the running service")
+    parser.add_argument("--seed", type=int, default=1000, help="number of Promotions to create first")
+    parser.add_argument("--requests", type=int, default=5000, help="number of requests in the workload")
+    parser.add_argument("--concurrency", type=int, default=4, help="number of threads sending requests")
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help="weights like list=40,get=40,update=20")
+    parser.add_argument("--random-seed", type=int, default=2023, help="seed for a repeatable workload")
+    parser.add_argument("--output", default="load_results.json", help="JSON file to write the results to")
+    args = parser.parse_args()
+
+    rng = random.Random(args.random_seed)
+    client = RemoteClient(args.url, args.api_key) if args.url else LocalClient()
+    ids = seed(client.session(), args.seed, rng)
+    requests = plan(args.mix, args.requests, ids, rng)
+    timings, elapsed = run(client, requests, args.concurrency)
+
+    results = {
+        "commit": git_commit(),
+        "time": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "target": client.target,
+        "seed": args.seed,
+        "concurrency": args.concurrency,
+        "random_seed": args.random_seed,
+        "mix": args.mix,
+        "total": summarize([timing for operation in timings.values() for timing in operation], elapsed),
+        "operations": {operation: summarize(timings[operation], elapsed) for operation in sorted(timings)},
+    }
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+        output.write("\n")
+
+    print(f"{results['total']['requests']} requests to {client.target} in {elapsed:.1f}s with {args.concurrency} threads")
+    print(f"  {'operation':<12}{'rps':>9}{'p50 ms':>10}{'p90 ms':>10}{'p99 ms':>10}{'errors':>8}")
+    for operation, summary in [("total", results["total"])] + list(results["operations"].items()):
+        print(
+            f"  {operation:<12}{summary['rps']:>9}{summary['p50_ms']:>10}{summary['p90_ms']:>10}"
+            f"{summary['p99_ms']:>10}{summary['errors']:>8}"
+        )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
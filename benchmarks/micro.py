@@ -0,0 +1,146 @@
+"""
+Model Microbenchmarks
+
+Times Promotion.serialize, Promotion.deserialize, the Promotype enum
+conversions, marshal and the compiled serializer on batches built with
+PromotionFactory, and compares them with the baselines stored in
+benchmarks/baselines.json.
+
+Every time is divided by the time of a fixed pure Python calibration loop
+run at the same moment, so the baselines carry over from one machine to
+another and the gate does not trip because CI runs on a slower box. The
+ratios do change between Python versions so there is one set of baselines
+for each version, CI runs on 3.9.
+
+Run it from the root of the repo with:
+    DATABASE_URI=sqlite:// python -m benchmarks.micro            # print the results
+    DATABASE_URI=sqlite:// python -m benchmarks.micro --save     # store new baselines
+    DATABASE_URI=sqlite:// python -m benchmarks.micro --check    # fail on a regression
+"""
+import os
+import sys
+import json
+import timeit
+import argparse
+from flask_restx import marshal
+from service.models import Promotion, Promotype
+from service.routes import promotion_model, serialize_promotion
+from tests.factories import PromotionFactory
+
+BASELINES = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+# Baselines are kept per Python version
+PYTHON = f"{sys.version_info.major}.{sys.version_info.minor}"
+
+# Largest slowdown against the baseline in percent before --check fails
+MAX_REGRESSION = float(os.getenv("BENCH_MAX_REGRESSION", "30"))
+
+
+class Plain:  # pylint: disable=too-few-public-methods
+    """A plain object with the same fields as a Promotion, for the calibration loop"""
+
+    def __init__(self, index: int):
+        self.id = index  # pylint: disable=invalid-name
+        self.name = f"name-{index}"
+        self.category = "holiday"
+        self.available = index % 2 == 0
+
+
+def calibration(objects: list):
+    """A fixed amount of plain Python work to measure the speed of the machine with"""
+    return [
+        {"id": str(obj.id), "name": obj.name, "category": obj.category, "available": obj.available}
+        for obj in objects
+    ]
+
+
+def make_benchmarks(rows: int) -> dict:
+    """Returns the functions to time, each one handles rows Promotions"""
+    promotions = PromotionFactory.build_batch(rows)
+    data = [promotion.serialize() for promotion in promotions]
+    names = [promotion.promotype.name for promotion in promotions]
+    enums = [promotion.promotype for promotion in promotions]
+    objects = [Plain(index) for index in range(rows)]
+    return {
+        "calibration": lambda: calibration(objects),
+        "serialize": lambda: [promotion.serialize() for promotion in promotions],
+        "deserialize": lambda: [Promotion().deserialize(item) for item in data],
+        "enum_from_name": lambda: [getattr(Promotype, name) for name in names],
+        "enum_to_name": lambda: [promotype.name for promotype in enums],
+        "marshal": lambda: [marshal(item, promotion_model) for item in data],
+        "compiled_serializer": lambda: [serialize_promotion(promotion) for promotion in promotions],
+    }
+
+
+def measure(rows: int, repeat: int) -> dict:
+    """Returns the best time per row in microseconds and relative to the calibration loop"""
+    benchmarks = make_benchmarks(rows)
+    best = dict.fromkeys(benchmarks, float("inf"))
+    # take turns so that every benchmark sees the same conditions as the calibration
+    for _ in range(repeat):
+        for name, function in benchmarks.items():
+            best[name] = min(best[name], timeit.timeit(function, number=1))
+    results = {name: {"us_per_row": elapsed / rows * 1e6} for name, elapsed in best.items()}
+    reference = results["calibration"]["us_per_row"]
+    for result in results.values():
+        result["relative"] = result["us_per_row"] / reference
+    return results
+
+
+def compare(results: dict, baselines: dict, max_regression: float) -> list:
+    """Returns the names of the benchmarks that are more than max_regression percent slower"""
+    regressions = []
+    for name, result in results.items():
+        baseline = baselines.get(name)
+        if name == "calibration" or baseline is None:
+            continue
+        change = (result["relative"] / baseline["relative"] - 1) * 100
+        result["change_percent"] = change
+        if change > max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    """Runs the benchmarks and saves or checks the baselines"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=5000, help="number of Promotions in each batch")
+    parser.add_argument("--repeat", type=int, default=10, help="number of runs to take the best of")
+    parser.add_argument("--save", action="store_true", help="store the results as the new baselines")
+    parser.add_argument("--check", action="store_true", help="exit with 1 if any benchmark regressed")
+    parser.add_argument("--max-regression", type=float, default=MAX_REGRESSION,
+                        help="largest slowdown in percent that --check allows")
+    parser.add_argument("--baselines", default=BASELINES, help="JSON file with the baselines")
+    args = parser.parse_args()
+
+    results = measure(args.rows, args.repeat)
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines, encoding="utf-8") as baseline_file:
+            baselines = json.load(baseline_file)
+    regressions = compare(results, baselines.get(PYTHON, {}), args.max_regression)
+
+    print(f"Microbenchmarks over {args.rows} Promotions on Python {PYTHON} (best of {args.repeat})")
+    for name, result in results.items():
+        change = result.get("change_percent")
+        change = "" if change is None else f"{change:+7.1f}% vs baseline"
+        print(f"  {name:<22}{result['us_per_row']:8.3f} us {result['relative']:7.3f}x  {change}")
+
+    if args.save:
+        baselines[PYTHON] = {
+            name: {key: round(value, 4) for key, value in result.items() if key != "change_percent"}
+            for name, result in results.items()
+        }
+        with open(args.baselines, "w", encoding="utf-8") as baseline_file:
+            json.dump(baselines, baseline_file, indent=2, sort_keys=True)
+            baseline_file.write("\n")
+        print(f"Baselines for Python {PYTHON} saved to {args.baselines}")
+    elif args.check and PYTHON not in baselines:
+        print(f"No baselines for Python {PYTHON}, run with --save to store them")
+    if args.check and regressions:
+        print(f"Slower than the baseline by more than {args.max_regression}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Serialization Benchmark
+
+Compares the per-row cost of the original marshal(promotion.serialize())
+path with the compiled serializer, of the two JSON encoders, and of
+loading Promotions through the ORM against the projected rows that the
+list endpoint reads.
+
+Run it from the root of the repo with:
+    DATABASE_URI=sqlite:// python -m benchmarks.serialization --rows 10000
+"""
+import json
+import timeit
+import argparse
+from flask_restx import marshal
+from service.common import serializer
+from service import app, create_app
+from service.models import db, Promotion
+from service.routes import promotion_model, serialize_promotion, serialize_row
+from tests.factories import PromotionFactory
+
+
+def per_row(function, rows: int, repeat: int) -> float:
+    """Returns the best time in microseconds per row over several runs"""
+    return min(timeit.repeat(function, number=1, repeat=repeat)) / rows * 1e6
+
+
+def main():
+    """Runs the benchmark and prints the results"""
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000, help="number of Promotions to serialize")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs to take the best of")
+    args = parser.parse_args()
+
+    promotions = PromotionFactory.build_batch(args.rows)
+    marshalled = [marshal(promotion.serialize(), promotion_model) for promotion in promotions]
+    assert marshalled == [serialize_promotion(promotion) for promotion in promotions]
+
+    results = {
+        "marshal(serialize())": per_row(
+            lambda: [marshal(promotion.serialize(), promotion_model) for promotion in promotions], args.rows, args.repeat
+        ),
+        "compiled serializer": per_row(
+            lambda: [serialize_promotion(promotion) for promotion in promotions], args.rows, args.repeat
+        ),
+        "json.dumps": per_row(lambda: json.dumps(marshalled), args.rows, args.repeat),
+    }
+    if serializer.orjson is not None:
+        results["orjson.dumps"] = per_row(lambda: serializer.orjson.dumps(marshalled), args.rows, args.repeat)
+
+    app.config["DB_CREATE_TABLES"] = True
+    create_app()
+    with app.app_context():
+        Promotion.create_many(promotions)
+
+        def load_objects():
+            db.session.expunge_all()
+            return [serialize_promotion(promotion) for promotion in Promotion.query.order_by(Promotion.id)]
+
+        def load_rows():
+            return [serialize_row(row) for row in Promotion.project().order_by(Promotion.id)]
+
+        assert load_objects() == load_rows()
+        results["load + serialize ORM"] = per_row(load_objects, args.rows, args.repeat)
+        results["load + serialize rows"] = per_row(load_rows, args.rows, args.repeat)
+        Promotion.query.delete()
+        db.session.commit()
+
+    print(f"Per-row cost over {args.rows} Promotions (best of {args.repeat})")
+    for name, micros in results.items():
+        print(f"  {name:<24} {micros:8.2f} us")
+
+
+if __name__ == "__main__":
+    main()
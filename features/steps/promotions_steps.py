@@ -32,7 +32,8 @@ def step_impl(context):
     """ Delete all Promotions and load new ones """
     # List all of the promotions and delete them one by one
     rest_endpoint = f"{context.BASE_URL}/api/promotions"
-    context.resp = requests.get(rest_endpoint)
+    # stream the whole list, a plain GET only returns the first page
+    context.resp = requests.get(rest_endpoint, params={"stream": "true"})
     expect(context.resp.status_code).to_equal(200)
     for promotion in context.resp.json():
         context.resp = requests.delete(f"{rest_endpoint}/{promotion['id']}",
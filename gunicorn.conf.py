@@ -0,0 +1,50 @@
+"""
+Gunicorn Configuration
+
+Loaded by gunicorn from the working directory. Every worker writes its
+Prometheus samples to PROMETHEUS_MULTIPROC_DIR so that /metrics can add up
+all of the workers, see service.common.metrics
+
+With GUNICORN_PRELOAD=true the app is imported and initialized once in the
+master and the workers are forked from it, sharing its memory copy-on-write,
+so they start serving without importing anything. post_fork() then gives
+each worker its own database connections and change listener
+
+With GUNICORN_ASGI=true the workers run the ASGI app in service.asgi under
+uvicorn, which serves the read endpoints with async SQLAlchemy
+"""
+import os
+import shutil
+
+# must be set before prometheus_client is imported by the workers
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/prometheus_multiproc")
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "false").lower() == "true"
+asgi = os.getenv("GUNICORN_ASGI", "false").lower() == "true"
+
+# pylint: disable=invalid-name
+factory = "service.asgi:create_asgi_app" if asgi else "service:create_app"
+wsgi_app = f"{factory}(preload=True)" if preload_app else f"{factory}()"
+worker_class = "uvicorn.workers.UvicornWorker" if asgi else "sync"
+
+
+def on_starting(server):  # pylint: disable=unused-argument
+    """Removes the samples left behind by the previous run"""
+    path = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+
+
+def child_exit(server, worker):  # pylint: disable=unused-argument
+    """Drops the gauges of a worker that has exited"""
+    from prometheus_client import multiprocess  # pylint: disable=import-outside-toplevel
+
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Gives a worker forked from a preloaded master its own connections"""
+    if server.cfg.preload_app:
+        from service import post_fork as ready_worker  # pylint: disable=import-outside-toplevel
+
+        ready_worker()
@@ -1,8 +1,8 @@
 """
 Package: service
 Package for the application models and service routes
-This module creates and configures the Flask app and sets up the logging
-and SQL database
+This module creates the Flask app, create_app() sets up the logging and
+SQL database
 """
 import sys
 import os
@@ -47,25 +47,74 @@ api = Api(app,
 from service import routes, models  # noqa: E402, E261, C0412
 
 # pylint: disable=wrong-import-position
-from service.common import error_handlers, cli_commands  # noqa: F401, E402
+from service.common import error_handlers, cli_commands, metrics, timing, slow_queries  # noqa: F401, E402
 
-# Set up logging for production
-log_handlers.init_logging(app, "gunicorn.error")
 
-app.logger.info(70 * "*")
-app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
-app.logger.info(70 * "*")
+def create_app(preload: bool = False) -> Flask:
+    """Initializes the service and returns the Flask app
 
-try:
-    models.init_db(app)  # make our SQLAlchemy tables
-except Exception as error:  # pylint: disable=broad-except
-    app.logger.critical("%s: Cannot continue", error)
-    # gunicorn requires exit code 4 to stop spawning workers when they die
-    sys.exit(4)
+    Importing the package only builds the app, this sets up logging, the
+    database and the instrumentation. No connection is opened unless
+    DB_CREATE_TABLES is set, the schema is made by ``flask db-migrate``.
+    Calling it again returns the same app.
 
-app.logger.info("Service initialized!")
+    :param preload: True when gunicorn loads the app in the master before
+        forking the workers, the change listener is then started by
+        post_fork() in each worker instead
+    :type preload: bool
 
-# If an API Key was not provided, autogenerate one
-if not app.config['API_KEY']:
-    app.config['API_KEY'] = routes.generate_apikey()
-    app.logger.info(f"Missing API Key! Autogenerated: {app.config['API_KEY']}")
+    :return: the Flask app
+    :rtype: Flask
+
+    """
+    if "promotions" in app.extensions:
+        return app
+
+    # Set up logging for production
+    log_handlers.init_logging(app, "gunicorn.error")
+
+    app.logger.info(70 * "*")
+    app.logger.info("  S E R V I C E   R U N N I N G  ".center(70, "*"))
+    app.logger.info(70 * "*")
+
+    try:
+        models.init_app(app)
+        if app.config["DB_CREATE_TABLES"]:
+            models.db.create_all()  # make our SQLAlchemy tables
+        metrics.init_metrics(app, models.db.engine, models.cache)
+        timing.init_timing(app, models.db.engine)
+        slow_queries.init_slow_query_log(app, models.db.engine)
+        for replica in models.replicas.engines:
+            metrics.instrument_engine(replica)
+            timing.time_statements(replica)
+            slow_queries.init_slow_query_log(app, replica)
+        if not preload:
+            models.Promotion.start_listener(app)
+    except Exception as error:  # pylint: disable=broad-except
+        app.logger.critical("%s: Cannot continue", error)
+        # gunicorn requires exit code 4 to stop spawning workers when they die
+        sys.exit(4)
+
+    app.extensions["promotions"] = True
+    app.logger.info("Service initialized!")
+
+    # If an API Key was not provided, autogenerate one
+    if not app.config['API_KEY']:
+        app.config['API_KEY'] = routes.generate_apikey()
+        app.logger.info(f"Missing API Key! Autogenerated: {app.config['API_KEY']}")
+    return app
+
+
+def post_fork():
+    """Readies a worker that was forked from a master that preloaded the app
+
+    The pooled connections were opened by the master and must not be shared,
+    the cache may be stale by now and the listener thread did not survive
+    the fork
+    """
+    with app.app_context():
+        # close=False leaves the sockets of the master alone
+        for engine in models.db.engines.values():
+            engine.dispose(close=False)
+        models.cache.clear()
+        models.Promotion.start_listener(app)
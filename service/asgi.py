@@ -0,0 +1,283 @@
+"""
+ASGI Entry Point
+
+An optional ASGI app that answers the read endpoints, GET /api/promotions,
+/api/promotions/<id> and /api/promotions/stats, through async SQLAlchemy
+sessions, so that one process can keep many requests waiting on the
+database at once instead of one per sync worker. They share the Promotion
+model, the cache and the serializers with the Flask app, and read from the
+DATABASE_REPLICA_URIS the same way, see service.common.replicas.
+
+Every other request, and any read that the async path cannot answer exactly
+like the Flask app would (an X-Fields mask, a streamed list, an estimated
+count, a name search, a missing Promotion or an invalid argument), is passed
+on to the Flask app running in a pool of ASGI_WSGI_THREADS threads. Run it with:
+
+    uvicorn --factory service.asgi:create_asgi_app --port 8080
+
+or under gunicorn with GUNICORN_ASGI=true, see gunicorn.conf.py
+"""
+import time
+from a2wsgi import WSGIMiddleware
+from flask import Flask, request
+from flask_restx import marshal
+from sqlalchemy import select, func
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import quote_etag
+from service import create_app
+from service.models import Promotion, DataValidationError, cache
+from service.common import metrics, slow_queries, status
+from service.common.replicas import ReplicaSet, replica_request
+from service.common.serializer import dumps
+from service.routes import (
+    NDJSON_MEDIA_TYPE,
+    PromotionCollection,
+    PromotionResource,
+    PromotionStatsResource,
+    etag_header,
+    fields_args,
+    filter_args,
+    get_filters,
+    list_columns,
+    make_etag,
+    next_page_headers,
+    page_size,
+    promotion_args,
+    promotion_serializer,
+    row_serializer,
+    stats_body,
+    stats_model,
+)
+
+# The async driver used in place of the sync one in DATABASE_URI
+ASYNC_DRIVERS = {"postgresql": "postgresql+asyncpg", "sqlite": "sqlite+aiosqlite"}
+
+
+def async_database_uri(uri: str) -> str:
+    """Returns the database URI with the async driver of its database"""
+    url = make_url(uri)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver for {backend}")
+    return url.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+
+######################################################################
+# Read handlers, each takes a function that opens an AsyncSession and
+# returns (body, status, headers) or None to pass the request on to the
+# Flask app
+######################################################################
+async def get_promotion(sessions, promotion_id):
+    """Answers GET /api/promotions/<promotion_id> like PromotionResource.get"""
+    args = fields_args.parse_args()
+    try:
+        promotion_id = int(promotion_id)
+    except ValueError:
+        return None
+    data = Promotion.cached(promotion_id)
+    if request.if_none_match:
+        # answer from the version alone when the client is up to date
+        if data is not None:
+            version = data["version"]
+        else:
+            async with sessions() as session:
+                version = await session.scalar(select(Promotion.version).where(Promotion.id == promotion_id))
+        etag = make_etag(promotion_id, version, args["fields"])
+        if version is not None and request.if_none_match.contains_weak(etag):
+            return None, status.HTTP_304_NOT_MODIFIED, {"ETag": quote_etag(etag)}
+
+    if data is not None:
+        promotion = Promotion(**data)
+    else:
+        async with sessions() as session:
+            promotion = await session.get(Promotion, promotion_id)
+        if promotion is None:
+            return None
+        if session.info.get("replica") is None:
+            Promotion.remember(promotion)
+    return promotion_serializer(args["fields"])(promotion), status.HTTP_200_OK, etag_header(promotion, args["fields"])
+
+
+async def list_promotions(sessions):
+    """Answers GET /api/promotions like PromotionCollection.get, one page at a time"""
+    args = promotion_args.parse_args()
+    ndjson = request.accept_mimetypes.best_match(["application/json", NDJSON_MEDIA_TYPE]) == NDJSON_MEDIA_TYPE
+    if ndjson or args["stream"] or (args["count"] and args["estimate"]) or args["q"] is not None:
+        return None
+    filters = Promotion.build_filters(**get_filters(args))
+    statement = select(*Promotion.read_columns(list_columns(args))).where(*filters)
+    statement, key = Promotion.seek(statement, args["sort"], args["cursor"])
+    limit = page_size(args)
+    # fetch one extra row to find out if there is another page
+    statement = statement.limit(limit + 1)
+
+    headers = {}
+    async with sessions() as session:
+        if args["count"]:
+            count = await session.scalar(select(func.count(Promotion.id)).where(*filters))
+            headers["X-Total-Count"] = str(count)
+        promotions = (await session.execute(statement)).all()
+
+    promotions, next_cursor = Promotion.next_page(promotions, limit, key)
+    serializer = row_serializer(args["fields"])
+    results = [serializer(promotion) for promotion in promotions]
+    if next_cursor:
+        headers.update(next_page_headers(next_cursor))
+    return results, status.HTTP_200_OK, headers
+
+
+async def get_stats(sessions):
+    """Answers GET /api/promotions/stats like PromotionStatsResource.get"""
+    args = filter_args.parse_args()
+    async with sessions() as session:
+        result = await session.execute(Promotion.stats_statement(**get_filters(args)))
+        groups = result.mappings().all()
+    return marshal(stats_body(groups), stats_model), status.HTTP_200_OK, {}
+
+
+READ_HANDLERS = {
+    PromotionResource: get_promotion,
+    PromotionCollection: list_promotions,
+    PromotionStatsResource: get_stats,
+}
+
+
+######################################################################
+# The ASGI app
+######################################################################
+class AsyncReadApp:
+    """Serves the read endpoints with async SQLAlchemy and the rest with the Flask app
+
+    :param flask_app: the initialized Flask app, see create_app()
+    :type flask_app: Flask
+
+    """
+
+    def __init__(self, flask_app: Flask):
+        self.flask_app = flask_app
+        self.wsgi = WSGIMiddleware(flask_app, workers=flask_app.config["ASGI_WSGI_THREADS"])
+        self.engine = None
+        self.sessions = None
+        self.replicas = ReplicaSet()
+
+    def start(self):
+        """Creates the async engines, in the worker process rather than before a fork"""
+        if self.engine is not None:
+            return
+        config = self.flask_app.config
+        options = dict(config["SQLALCHEMY_ENGINE_OPTIONS"])
+        # the pool has to be one that works with asyncio
+        options.pop("poolclass", None)
+        self.engine = create_async_engine(async_database_uri(config["SQLALCHEMY_DATABASE_URI"]), **options)
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        self.replicas.configure(
+            [create_async_engine(async_database_uri(uri), **options) for uri in config["DATABASE_REPLICA_URIS"]],
+            config["REPLICA_RETRY_SECONDS"],
+        )
+        for engine in [self.engine] + self.replicas.engines:
+            metrics.instrument_engine(engine.sync_engine)
+            slow_queries.init_slow_query_log(self.flask_app, engine.sync_engine)
+
+    async def stop(self):
+        """Closes the connections of the async engines"""
+        if self.engine is not None:
+            for engine in [self.engine] + self.replicas.engines:
+                await engine.dispose()
+            self.replicas.configure([])
+            self.engine = None
+            self.sessions = None
+
+    def session(self):
+        """Returns a new AsyncSession on the next healthy replica, or on the primary"""
+        replica = self.replicas.choose() if replica_request() else None
+        return self.sessions(bind=replica or self.engine, info={"replica": replica})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http" and scope["method"] == "GET" and await self.read(scope, send):
+            return
+        else:
+            await self.wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        """Starts and stops the async engine with the server"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await self.stop()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def request_context(self, scope):
+        """Returns a Flask request context for an ASGI request, so the parsers and url_for work"""
+        headers = [(name.decode("latin-1"), value.decode("latin-1")) for name, value in scope["headers"]]
+        host = next((value for name, value in headers if name.lower() == "host"), None)
+        if host is None and scope.get("server"):
+            host = f'{scope["server"][0]}:{scope["server"][1]}'
+        return self.flask_app.test_request_context(
+            scope["path"],
+            base_url=f'{scope.get("scheme", "http")}://{host or "localhost"}{scope.get("root_path", "")}',
+            query_string=scope["query_string"],
+            headers=headers,
+        )
+
+    async def read(self, scope, send) -> bool:
+        """Answers a read request, returns False to pass it on to the Flask app"""
+        self.start()
+        start = time.perf_counter()
+        with self.request_context(scope) as context:
+            if "X-Fields" in request.headers:
+                return False
+            context.match_request()
+            if request.routing_exception is not None:
+                return False
+            view = self.flask_app.view_functions[request.url_rule.endpoint]
+            handler = READ_HANDLERS.get(getattr(view, "view_class", None))
+            if handler is None:
+                return False
+            metrics.REQUESTS_IN_FLIGHT.inc()
+            try:
+                response = await handler(self.session, **request.view_args)
+            except (HTTPException, DataValidationError):
+                # the Flask app answers with its own error handlers
+                response = None
+            finally:
+                metrics.REQUESTS_IN_FLIGHT.dec()
+            if response is None:
+                return False
+            body, code, headers = response
+            await send_response(send, code, headers, body)
+            metrics.REQUEST_LATENCY.labels(request.url_rule.rule, "GET", code).observe(time.perf_counter() - start)
+            metrics.update_cache_stats(cache)
+        return True
+
+
+async def send_response(send, code: int, headers: dict, body=None):
+    """Sends a JSON response, or one without a body when body is None"""
+    content = b"" if body is None else (dumps(body) + "\n").encode("utf-8")
+    raw_headers = [(name.lower().encode("latin-1"), str(value).encode("latin-1")) for name, value in headers.items()]
+    if body is not None:
+        raw_headers.append((b"content-type", b"application/json"))
+        raw_headers.append((b"content-length", str(len(content)).encode("latin-1")))
+    await send({"type": "http.response.start", "status": code, "headers": raw_headers})
+    await send({"type": "http.response.body", "body": content})
+
+
+def create_asgi_app(preload: bool = False) -> AsyncReadApp:
+    """Initializes the service and returns its ASGI app
+
+    :param preload: True when gunicorn loads the app in the master before
+        forking the workers, see create_app()
+    :type preload: bool
+
+    :return: the ASGI app
+    :rtype: AsyncReadApp
+
+    """
+    return AsyncReadApp(create_app(preload))
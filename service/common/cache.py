@@ -0,0 +1,89 @@
+"""
+Cache
+
+This module contains a small in-process cache that is used to keep hot
+rows out of the database
+"""
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """A thread safe least recently used cache whose entries expire after a TTL
+
+    :param maxsize: the most entries to keep, 0 turns the cache off
+    :type maxsize: int
+    :param ttl: the number of seconds an entry stays fresh
+    :type ttl: float
+
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0, timer=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize: int = None, ttl: float = None):
+        """Changes the size and TTL of the cache and empties it"""
+        with self._lock:
+            if maxsize is not None:
+                self.maxsize = maxsize
+            if ttl is not None:
+                self.ttl = ttl
+            self._data.clear()
+
+    def get(self, key, default=None):
+        """Returns the value for a key, or default if it is missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > self.timer():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Stores a value, evicting the least recently used entry when full"""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = (self.timer() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, *keys):
+        """Removes the entries for the keys if they are cached"""
+        with self._lock:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def clear(self):
+        """Removes every entry"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters and the size of the cache"""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+            }
+
+    def __len__(self):
+        return len(self._data)
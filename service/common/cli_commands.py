@@ -1,7 +1,10 @@
 """
 Flask CLI Command Extensions
 """
-from service import app
+import json
+import click
+from service import app, migrations
+from service.common import slow_queries
 from service.models import db
 
 
@@ -19,3 +22,60 @@ def db_create():
     db.drop_all()
     db.create_all()
     db.session.commit()
+
+
+######################################################################
+# Command to apply the schema migrations
+# Usage:
+#   flask db-migrate
+######################################################################
+@app.cli.command("db-migrate")
+@click.option("--target", type=int, default=None, help="Stop at this schema version")
+def db_migrate(target):
+    """
+    Applies the schema migrations that have not been applied yet, then
+    installs or drops the promotion_stats triggers to match
+    PROMOTION_STATS_SUMMARY. Safe to run against a live database.
+    """
+    applied = migrations.upgrade(db.engine, target)
+    for version in applied:
+        click.echo(f"Applied migration {version}")
+    click.echo(f"Schema is at version {migrations.current_version(db.engine)}")
+    if migrations.set_stats_summary(db.engine, app.config["PROMOTION_STATS_SUMMARY"]):
+        click.echo("promotion_stats is maintained by triggers")
+
+
+######################################################################
+# Command to summarize the slow query log
+# Usage:
+#   flask slow-queries
+######################################################################
+@app.cli.command("slow-queries")
+@click.option("--log", "path", default=None, help="The slow query log, SLOW_QUERY_LOG by default")
+@click.option("--top", type=int, default=10, help="Show this many statements")
+@click.option("--plans/--no-plans", default=False, help="Show the last EXPLAIN plan of each statement")
+def slow_queries_report(path, top, plans):
+    """
+    Lists the statements that spent the most time over the slow query
+    threshold, worst first.
+    """
+    path = path or app.config["SLOW_QUERY_LOG"]
+    if not path:
+        click.echo("Pass the log with --log, SLOW_QUERY_LOG is not set")
+        return
+    try:
+        with open(path, encoding="utf-8") as log:
+            worst = slow_queries.summarize(log, top)
+    except FileNotFoundError:
+        click.echo(f"No slow queries have been logged to {path}")
+        return
+    for rank, summary in enumerate(worst, start=1):
+        click.echo(
+            f"{rank}. {summary['count']} calls, total {summary['total_ms']:.1f} ms, "
+            f"mean {summary['mean_ms']:.1f} ms, max {summary['max_ms']:.1f} ms"
+        )
+        click.echo(f"   {summary['statement']}")
+        if summary["routes"]:
+            click.echo(f"   from {', '.join(summary['routes'])}")
+        if plans and summary["plan"] is not None:
+            click.echo(json.dumps(summary["plan"], indent=2))
@@ -18,7 +18,8 @@
 Module: error_handlers
 """
 # from flask import jsonify
-from service.models import DataValidationError, DatabaseConnectionError
+from flask import request
+from service.models import DataValidationError, DatabaseConnectionError, VersionConflictError
 from service import app, api
 from . import status
 
@@ -128,6 +129,25 @@ def request_validation_error(error):
     }, status.HTTP_400_BAD_REQUEST
 
 
+@api.errorhandler(VersionConflictError)
+def version_conflict_error(error):
+    """ Handles writes to a Promotion that changed since it was read """
+    message = str(error)
+    app.logger.warning(message)
+    if request.if_match:
+        # the If-Match version was current when it was checked but not when it was written
+        return {
+            'status_code': status.HTTP_412_PRECONDITION_FAILED,
+            'error': 'Precondition Failed',
+            'message': message
+        }, status.HTTP_412_PRECONDITION_FAILED
+    return {
+        'status_code': status.HTTP_409_CONFLICT,
+        'error': 'Conflict',
+        'message': message
+    }, status.HTTP_409_CONFLICT
+
+
 @api.errorhandler(DatabaseConnectionError)
 def database_connection_error(error):
     """ Handles Database Errors from connection attempts """
@@ -0,0 +1,33 @@
+"""
+Explain
+
+This module contains an EXPLAIN construct for SQLAlchemy so that a query
+built with the ORM can be handed to the PostgreSQL planner with its bound
+parameters intact, see Promotion.count() for how the estimates are used
+"""
+import json
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+
+class Explain(Executable, ClauseElement):
+    """An EXPLAIN of a SELECT statement"""
+
+    inherit_cache = False
+
+    def __init__(self, statement, options: str = "FORMAT JSON"):
+        self.statement = statement
+        self.options = options
+
+
+@compiles(Explain, "postgresql")
+def compile_explain(element, compiler, **kwargs):
+    """Renders the EXPLAIN in front of the compiled statement"""
+    return f"EXPLAIN ({element.options}) {compiler.process(element.statement, **kwargs)}"
+
+
+def plan_rows(plan) -> int:
+    """Returns the number of rows the planner expects from an EXPLAIN (FORMAT JSON)"""
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
@@ -0,0 +1,88 @@
+"""
+Change Listener
+
+This module contains a background thread that LISTENs on a PostgreSQL
+channel and hands the ids sent with NOTIFY to callbacks, so that every
+worker process can evict rows that another process changed from its
+local caches
+"""
+import select
+import logging
+import threading
+
+logger = logging.getLogger("flask.app")
+
+
+class ChangeListener(threading.Thread):
+    """Listens for NOTIFY messages that carry comma separated ids
+
+    Callbacks are called with a list of ids, or with None when messages
+    may have been missed (e.g. after a reconnect) and everything must be
+    considered stale.
+
+    :param engine: the SQLAlchemy engine of the PostgreSQL database
+    :param channel: the name of the channel to LISTEN on
+    :type channel: str
+
+    """
+
+    def __init__(self, engine, channel: str, timeout: float = 5.0, retry: float = 5.0):
+        super().__init__(name=f"listener-{channel}", daemon=True)
+        self.engine = engine
+        self.channel = channel
+        self.timeout = timeout
+        self.retry = retry
+        self.callbacks = []
+        self._stopped = threading.Event()
+
+    def subscribe(self, callback):
+        """Adds a callback that is called with the ids that changed"""
+        self.callbacks.append(callback)
+
+    def stop(self):
+        """Asks the thread to stop after the current wait"""
+        self._stopped.set()
+
+    def dispatch(self, payloads: list):
+        """Passes the ids in NOTIFY payloads to every callback"""
+        ids = None
+        if payloads is not None:
+            ids = [int(value) for payload in payloads for value in payload.split(",") if value]
+            if not ids:
+                return
+        for callback in self.callbacks:
+            try:
+                callback(ids)
+            except Exception as error:  # pylint: disable=broad-except
+                logger.error("Change callback failed: %s", error)
+
+    def run(self):
+        while not self._stopped.is_set():
+            try:
+                self.listen()
+            except Exception as error:  # pylint: disable=broad-except
+                logger.warning("Listener on %s lost its connection: %s", self.channel, error)
+                self._stopped.wait(self.retry)
+
+    def listen(self):
+        """Waits for notifications on a dedicated connection until stopped"""
+        connection = self.engine.raw_connection()
+        # take the connection out of the pool so it does not hold a pool slot
+        connection.detach()
+        dbapi_connection = connection.driver_connection
+        try:
+            dbapi_connection.autocommit = True
+            with dbapi_connection.cursor() as cursor:
+                cursor.execute(f'LISTEN "{self.channel}"')
+            logger.info("Listening for changes on %s", self.channel)
+            # anything could have changed while we were not listening
+            self.dispatch(None)
+            while not self._stopped.is_set():
+                if select.select([dbapi_connection], [], [], self.timeout) == ([], [], []):
+                    continue
+                dbapi_connection.poll()
+                payloads = [notify.payload for notify in dbapi_connection.notifies]
+                dbapi_connection.notifies.clear()
+                self.dispatch(payloads)
+        finally:
+            connection.close()
@@ -0,0 +1,108 @@
+"""
+Metrics
+
+This module contains the Prometheus metrics served by /metrics: request
+latency by route, method and status, requests in flight, database query
+durations and the promotion cache counters.
+
+Under gunicorn every worker writes its samples to files in the directory
+named by PROMETHEUS_MULTIPROC_DIR (see gunicorn.conf.py) and /metrics adds
+them up, so any worker can answer a scrape for all of them
+"""
+import os
+import time
+from flask import g, request
+from sqlalchemy import event
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# The first word of the statements that are counted separately, anything else is OTHER
+OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+REQUEST_LATENCY = Histogram(
+    "promotions_request_duration_seconds",
+    "Time spent handling a request",
+    ["route", "method", "status"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "promotions_requests_in_flight",
+    "Requests being handled right now",
+    multiprocess_mode="livesum",
+)
+DB_QUERY_DURATION = Histogram(
+    "promotions_db_query_duration_seconds",
+    "Time spent executing a database statement",
+    ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+CACHE_STATS = {
+    key: Gauge(f"promotions_cache_{key}", f"Promotion cache {key} of the live workers", multiprocess_mode="livesum")
+    for key in ("hits", "misses", "evictions", "size")
+}
+
+
+def init_metrics(app, engine, cache):
+    """Instruments the Flask app, the SQLAlchemy engine and the promotion cache"""
+
+    @app.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        g.in_flight = True
+        REQUESTS_IN_FLIGHT.inc()
+
+    @app.after_request
+    def observe_request(response):
+        start = g.pop("request_start", None)
+        if start is not None:
+            # the url rule rather than the path so that every id shares one series
+            route = request.url_rule.rule if request.url_rule else "unmatched"
+            REQUEST_LATENCY.labels(route, request.method, response.status_code).observe(time.perf_counter() - start)
+        update_cache_stats(cache)
+        return response
+
+    @app.teardown_request
+    def end_request(_error=None):
+        if g.pop("in_flight", False):
+            REQUESTS_IN_FLIGHT.dec()
+
+    instrument_engine(engine)
+
+
+def instrument_engine(engine):
+    """Times the statements run on a SQLAlchemy engine by their operation"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_query_timer(_conn, _cursor, _statement, _parameters, context, _executemany):
+        context.query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def observe_query(_conn, _cursor, statement, _parameters, context, _executemany):
+        operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+        if operation not in OPERATIONS:
+            operation = "OTHER"
+        DB_QUERY_DURATION.labels(operation).observe(time.perf_counter() - context.query_start)
+
+
+def update_cache_stats(cache):
+    """Copies the counters of the promotion cache to the cache gauges"""
+    stats = cache.stats()
+    for key, gauge in CACHE_STATS.items():
+        gauge.set(stats[key])
+
+
+def render():
+    """Returns the metrics of every worker in the Prometheus text format and its content type"""
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
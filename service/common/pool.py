@@ -0,0 +1,68 @@
+"""
+Connection Pool
+
+This module contains a QueuePool that keeps track of how long requests wait
+to check out a connection, so that the pool of each worker can be sized
+from data. It is set as the poolclass in SQLALCHEMY_ENGINE_OPTIONS and its
+numbers are reported by the /health endpoint
+"""
+import time
+import threading
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """A QueuePool that times every checkout"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            with self._lock:
+                self.timeouts += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.checkouts += 1
+                self.wait_total += elapsed
+                self.wait_max = max(self.wait_max, elapsed)
+
+    def stats(self) -> dict:
+        """Returns the checkout counts and wait times in milliseconds"""
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_avg_ms": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "wait_max_ms": round(self.wait_max * 1000, 3),
+            }
+
+
+def pool_stats(pool) -> dict:
+    """Returns the size and usage of any SQLAlchemy pool as a dict"""
+    stats = {"class": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update(
+            {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                # negative while the pool has not opened pool_size connections yet
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow,  # pylint: disable=protected-access
+            }
+        )
+    if isinstance(pool, TimedQueuePool):
+        stats.update(pool.stats())
+    return stats
@@ -0,0 +1,162 @@
+"""
+Read Replicas
+
+This module sends the SELECTs of read-only requests (GET and HEAD) to the
+read replicas in DATABASE_REPLICA_URIS, taking turns between them, while
+writes and everything else stay on the primary in DATABASE_URI. A replica
+that cannot be connected to, or drops its connection, is ejected for
+REPLICA_RETRY_SECONDS and its turns go to the others, or to the primary
+when none are left.
+
+Reads stay on the primary for a request that sends X-Consistent-Read: true,
+such as a client that has to see what it just wrote, and for the rest of a
+request once it has written anything.
+"""
+import time
+import logging
+import threading
+from flask import has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+logger = logging.getLogger("flask.app")
+
+# Requests that only read and may be answered from a replica
+READ_METHODS = {"GET", "HEAD"}
+
+# Request header that keeps the reads of a request on the primary
+CONSISTENT_READ_HEADER = "X-Consistent-Read"
+
+
+def replica_request() -> bool:
+    """Returns True when the current request may read from a replica"""
+    return (
+        has_request_context()
+        and request.method in READ_METHODS
+        and request.headers.get(CONSISTENT_READ_HEADER, "").lower() != "true"
+    )
+
+
+class ReplicaSet:
+    """A thread safe round-robin over the replica engines that are healthy
+
+    :param retry: the number of seconds an ejected replica is left out
+    :type retry: float
+
+    """
+
+    def __init__(self, retry: float = 30.0, timer=time.monotonic):
+        self.retry = retry
+        self.timer = timer
+        self.engines = []
+        self._ejected = {}  # index of the engine -> time it may be tried again
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def configure(self, engines: list, retry: float = None):
+        """Replaces the replicas and watches them for connection errors
+
+        :param engines: the Engines (or AsyncEngines) of the replicas
+        :type engines: list
+        :param retry: the number of seconds an ejected replica is left out
+        :type retry: float
+
+        """
+        with self._lock:
+            self.engines = list(engines)
+            self._ejected.clear()
+            self._next = 0
+            if retry is not None:
+                self.retry = retry
+        for engine in self.engines:
+            self._watch(getattr(engine, "sync_engine", engine))
+
+    def _watch(self, engine):
+        """Ejects a replica when it fails to connect or loses its connection, once per engine"""
+        if not event.contains(engine, "handle_error", self._eject_on_connection_error):
+            event.listen(engine, "handle_error", self._eject_on_connection_error)
+
+    def _eject_on_connection_error(self, context):
+        if context.connection is not None and not context.is_disconnect:
+            return
+        with self._lock:
+            # the engine may have moved, or left, since it was first watched
+            engines = [getattr(engine, "sync_engine", engine) for engine in self.engines]
+        if context.engine in engines:
+            self.eject(engines.index(context.engine), context.original_exception)
+
+    def __len__(self):
+        return len(self.engines)
+
+    def choose(self):
+        """Returns the next healthy replica, or None when there is none"""
+        with self._lock:
+            now = self.timer()
+            for _ in range(len(self.engines)):
+                index = self._next % len(self.engines)
+                self._next += 1
+                if self._ejected.get(index, now) <= now:
+                    # an ejected replica is tried again once its time is up
+                    self._ejected.pop(index, None)
+                    return self.engines[index]
+        return None
+
+    def eject(self, index: int, error=None):
+        """Leaves a replica out for retry seconds"""
+        with self._lock:
+            self._ejected[index] = self.timer() + self.retry
+        logger.warning(
+            "Ejected replica %s for %ss: %s",
+            self.engines[index].url.render_as_string(hide_password=True), self.retry, error,
+        )
+
+    def stats(self) -> list:
+        """Returns the URL, without the password, and the health of every replica"""
+        with self._lock:
+            now = self.timer()
+            return [
+                {
+                    "url": engine.url.render_as_string(hide_password=True),
+                    "healthy": self._ejected.get(index, now) <= now,
+                }
+                for index, engine in enumerate(self.engines)
+            ]
+
+
+class RoutingSession(Session):
+    """A Flask-SQLAlchemy session that reads from a replica during read-only requests
+
+    Pass it with the ReplicaSet in the session_options of SQLAlchemy. One
+    replica is chosen for each request and the session goes back to the
+    primary once it writes, until reset_routing() is called at the end of
+    the request.
+    """
+
+    def __init__(self, db, replicas: ReplicaSet = None, **kwargs):
+        super().__init__(db, **kwargs)
+        self.replicas = replicas
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and clause is not None:
+            if clause.is_dml:
+                self.info["wrote"] = True
+            elif clause.is_select and self.reads_from_replica():
+                if "replica" not in self.info:
+                    self.info["replica"] = self.replicas.choose()
+                if self.info["replica"] is not None:
+                    return self.info["replica"]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def reads_from_replica(self) -> bool:
+        """Returns True when the SELECTs of this session can go to a replica"""
+        return bool(self.replicas) and not self.info.get("wrote") and replica_request()
+
+    def reset_routing(self):
+        """Forgets the replica and the writes of the last request"""
+        self.info.pop("replica", None)
+        self.info.pop("wrote", None)
+
+    def flush(self, objects=None):
+        if self.new or self.dirty or self.deleted:
+            self.info["wrote"] = True
+        super().flush(objects)
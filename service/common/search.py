@@ -0,0 +1,189 @@
+"""
+Name Search
+
+This module contains an in-process index over the names of the Promotions
+that answers prefix, substring and fuzzy (trigram) searches without scanning
+every name. It stands in for the pg_trgm index on databases that do not have
+it, such as SQLite in development and tests, and ranks matches the same way.
+"""
+import re
+import time
+import bisect
+import threading
+from collections import Counter
+
+# pg_trgm splits text into words on anything that is not a letter or a digit
+WORD = re.compile(r"[^\W_]+")
+
+# Shortest search text that also matches inside names and by similarity
+MIN_FUZZY_LENGTH = 3
+
+
+def trigrams(text: str) -> set:
+    """Returns the trigrams of a text like pg_trgm's show_trgm()"""
+    grams = set()
+    for word in WORD.findall(text.lower()):
+        padded = f"  {word} "
+        grams.update(padded[start:start + 3] for start in range(len(padded) - 2))
+    return grams
+
+
+def similarity(grams: set, other: set, shared: int = None) -> float:
+    """Returns the share of trigrams two texts have in common like pg_trgm's similarity()"""
+    if shared is None:
+        shared = len(grams & other)
+    union = len(grams) + len(other) - shared
+    return shared / union if union else 0.0
+
+
+class NameIndex:
+    """A thread safe index of names by prefix and by trigram
+
+    The index is built from the database on the first search and then kept
+    up to date one id at a time: invalidate() marks the ids that changed and
+    the next refresh() reloads only those. It is rebuilt from scratch once it
+    is older than the TTL, to pick up changes made by other processes.
+
+    :param threshold: the similarity a fuzzy match needs, like pg_trgm.similarity_threshold
+    :type threshold: float
+    :param ttl: the number of seconds before the whole index is reloaded
+    :type ttl: float
+
+    """
+
+    # More changed ids than this are reloaded by rebuilding the whole index
+    MAX_RELOAD = 500
+
+    def __init__(self, threshold: float = 0.3, ttl: float = 300.0, timer=time.monotonic):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.timer = timer
+        self._names = None  # id -> lower case name, None until the index is built
+        self._grams = {}  # id -> trigrams of the name
+        self._postings = {}  # trigram -> ids of the names that have it
+        self._sorted = []  # (lower case name, id) in order for prefix searches
+        self._stale = set()  # ids to reload on the next refresh
+        self._expires = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def configure(self, threshold: float = None, ttl: float = None):
+        """Changes the threshold and TTL of the index and empties it"""
+        with self._lock:
+            if threshold is not None:
+                self.threshold = threshold
+            if ttl is not None:
+                self.ttl = ttl
+            self._names = None
+
+    def invalidate(self, *ids):
+        """Marks the names of some ids as changed, or every name when no ids are given"""
+        with self._lock:
+            if self._names is None and not self._refresh_lock.locked():
+                return  # nothing to reload until the index is first built
+            if ids:
+                self._stale.update(ids)
+            else:
+                self._names = None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._names or ())
+
+    def refresh(self, load):
+        """Brings the index up to date before a search
+
+        :param load: a function that takes a list of ids, or None for every
+            row, and returns their (id, name) pairs
+        :type load: callable
+
+        """
+        with self._refresh_lock:
+            with self._lock:
+                rebuild = self._names is None or self._expires <= self.timer() or len(self._stale) > self.MAX_RELOAD
+                stale, self._stale = self._stale, set()
+            if rebuild:
+                expires = self.timer() + self.ttl
+                rows = load(None)
+                with self._lock:
+                    self._build(rows)
+                    self._expires = expires
+            elif stale:
+                rows = load(sorted(stale))
+                with self._lock:
+                    for promotion_id in stale:
+                        self._remove(promotion_id)
+                    for promotion_id, name in rows:
+                        self._add(promotion_id, name)
+
+    def _build(self, rows):
+        self._names, self._grams, self._postings = {}, {}, {}
+        for promotion_id, name in rows:
+            self._names[promotion_id] = name.lower()
+            self._index_grams(promotion_id, name)
+        self._sorted = sorted((name, promotion_id) for promotion_id, name in self._names.items())
+
+    def _index_grams(self, promotion_id, name: str):
+        grams = trigrams(name)
+        self._grams[promotion_id] = grams
+        for gram in grams:
+            self._postings.setdefault(gram, set()).add(promotion_id)
+
+    def _add(self, promotion_id, name: str):
+        self._names[promotion_id] = name.lower()
+        self._index_grams(promotion_id, name)
+        bisect.insort(self._sorted, (name.lower(), promotion_id))
+
+    def _remove(self, promotion_id):
+        name = self._names.pop(promotion_id, None)
+        if name is None:
+            return
+        for gram in self._grams.pop(promotion_id):
+            ids = self._postings[gram]
+            ids.discard(promotion_id)
+            if not ids:
+                del self._postings[gram]
+        del self._sorted[bisect.bisect_left(self._sorted, (name, promotion_id))]
+
+    def search(self, text: str) -> list:
+        """Returns the ids of the names that match a search, best match first
+
+        A name matches when it starts with the text or, for texts of at least
+        MIN_FUZZY_LENGTH characters, when it contains the text or is at least
+        threshold similar to it. Prefix matches come first, then the rest by
+        similarity, then by name and id.
+
+        :param text: what to search for, case insensitive
+        :type text: str
+
+        :return: the ids of every matching name
+        :rtype: list
+
+        """
+        text = text.lower()
+        grams = trigrams(text)
+        with self._lock:
+            if self._names is None:
+                return []
+            # names that start with the text are next to each other in sorted order
+            prefixed = set()
+            position = bisect.bisect_left(self._sorted, (text,))
+            while position < len(self._sorted) and self._sorted[position][0].startswith(text):
+                prefixed.add(self._sorted[position][1])
+                position += 1
+            ranked = [
+                (False, -similarity(grams, self._grams[promotion_id]), self._names[promotion_id], promotion_id)
+                for promotion_id in prefixed
+            ]
+            if len(text) >= MIN_FUZZY_LENGTH:
+                shared = Counter()
+                for gram in grams:
+                    shared.update(self._postings.get(gram, ()))
+                for promotion_id, count in shared.items():
+                    if promotion_id in prefixed:
+                        continue
+                    score = similarity(grams, self._grams[promotion_id], count)
+                    if score >= self.threshold or text in self._names[promotion_id]:
+                        ranked.append((True, -score, self._names[promotion_id], promotion_id))
+        ranked.sort()
+        return [promotion_id for *_, promotion_id in ranked]
@@ -0,0 +1,174 @@
+"""
+Slow Query Log
+
+This module logs every database statement that takes longer than
+SLOW_QUERY_MS as one JSON line with its SQL, parameters, duration and the
+route that ran it. On PostgreSQL the plan of a sample of the slow SELECTs,
+set by SLOW_QUERY_EXPLAIN_SAMPLE, is added to the line. SELECTs that only
+read are run again under EXPLAIN (ANALYZE, BUFFERS), the rest, such as
+pg_advisory_lock() or set_config(), are only planned with EXPLAIN. The lines go to the file in SLOW_QUERY_LOG,
+or to the handlers of the app log when it is not set, and are summarized by:
+
+    flask slow-queries --log <file>
+"""
+import re
+import json
+import time
+import random
+import logging
+from datetime import datetime, timezone
+from flask import has_request_context, request
+from sqlalchemy import event
+
+logger = logging.getLogger("promotions.slow_queries")
+
+# A word followed by "(", a function call or an SQL keyword before a subquery or list
+CALL = re.compile(r"\b(\w+)\s*\(")
+
+# Functions and keywords that can be followed by "(" in a SELECT that only reads
+READ_ONLY_CALLS = {
+    "select", "from", "where", "and", "or", "not", "in", "exists", "any", "all", "as", "on", "join",
+    "values", "over", "filter", "cast", "count", "sum", "min", "max", "avg", "lower", "upper",
+    "coalesce", "length", "similarity", "word_similarity", "array_agg", "json_agg",
+}
+
+
+def read_only(statement: str) -> bool:
+    """Returns True for a SELECT that only reads, so that running it again has no side effects"""
+    if re.search(r"\bFOR\s+(UPDATE|NO\s+KEY\s+UPDATE|SHARE|KEY\s+SHARE)\b", statement, re.IGNORECASE):
+        return False
+    return all(name.lower() in READ_ONLY_CALLS for name in CALL.findall(statement))
+
+
+def explain(connection, statement, parameters):
+    """Returns the plan of a statement run on the same connection
+
+    A SELECT that only reads is run again under EXPLAIN (ANALYZE, BUFFERS)
+    for its actual times, any other statement is only planned with EXPLAIN
+    """
+    dbapi_connection = connection.connection.dbapi_connection
+    # a failed EXPLAIN must not abort the transaction that the statement is part of
+    savepoint = not getattr(dbapi_connection, "autocommit", False)
+    # a new cursor so that the rows of the original statement are left alone
+    cursor = dbapi_connection.cursor()
+    try:
+        if savepoint:
+            cursor.execute("SAVEPOINT slow_query_explain")
+        try:
+            options = "ANALYZE, BUFFERS, FORMAT JSON" if read_only(statement) else "FORMAT JSON"
+            cursor.execute(f"EXPLAIN ({options}) {statement}", parameters)
+            plan = cursor.fetchone()[0]
+        except Exception:
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+            raise
+        if savepoint:
+            cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    finally:
+        cursor.close()
+
+
+def explainable(connection, statement, executemany) -> bool:
+    """Returns True for a SELECT on PostgreSQL, which EXPLAIN can plan"""
+    return (
+        not executemany
+        and connection.dialect.name == "postgresql"
+        and statement.lstrip().upper().startswith("SELECT")
+    )
+
+
+def make_record(statement, parameters, duration: float) -> dict:
+    """Returns the log record of a slow statement"""
+    record = {
+        "time": datetime.now(timezone.utc).isoformat(),
+        "duration_ms": round(duration * 1000, 3),
+        "statement": statement,
+        "parameters": parameters,
+        "route": None,
+        "method": None,
+    }
+    if has_request_context():
+        record["route"] = request.url_rule.rule if request.url_rule else request.path
+        record["method"] = request.method
+    return record
+
+
+def init_logger(app, path: str = None):
+    """Sends the slow query lines to the file at path, or to the handlers of the app log"""
+    if path:
+        handler = logging.FileHandler(path, delay=True)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+    else:
+        # wherever the app logs, stderr under gunicorn, so the lines reach the cluster logs
+        for handler in app.logger.handlers:
+            logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = not logger.handlers
+
+
+def init_slow_query_log(app, engine):
+    """Logs the statements run on the SQLAlchemy engine that are slower than SLOW_QUERY_MS"""
+    threshold = app.config.get("SLOW_QUERY_MS")
+    if threshold is None or threshold < 0:
+        return
+    threshold /= 1000
+    sample = app.config.get("SLOW_QUERY_EXPLAIN_SAMPLE", 0.0)
+    if not logger.handlers:
+        init_logger(app, app.config.get("SLOW_QUERY_LOG"))
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_slow_query_timer(_conn, _cursor, _statement, _parameters, context, _executemany):
+        context.slow_query_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def log_slow_query(conn, _cursor, statement, parameters, context, executemany):
+        duration = time.perf_counter() - context.slow_query_start
+        if duration < threshold:
+            return
+        record = make_record(statement, parameters, duration)
+        if explainable(conn, statement, executemany) and random.random() < sample:
+            try:
+                record["plan"] = explain(conn, statement, parameters)
+            except Exception as error:  # pylint: disable=broad-except
+                record["plan_error"] = str(error)
+        logger.warning(json.dumps(record, default=str))
+
+
+def summarize(lines, top: int = 10) -> list:
+    """Groups slow query log lines by statement, worst total time first
+
+    :param lines: the JSON lines of a slow query log, other lines are skipped
+    :param top: the number of statements to return
+    :type top: int
+
+    :return: one dict per statement with its count, total, mean and max time, routes and a plan
+    :rtype: list
+
+    """
+    statements = {}
+    for line in lines:
+        try:
+            # lines copied from the app log start with its prefix
+            record = json.loads(line[line.index("{"):])
+            # the same statement with different parameters is one offender
+            key = " ".join(record["statement"].split())
+            float(record["duration_ms"])
+        except (ValueError, TypeError, KeyError, AttributeError):
+            continue  # a blank, cut off or unrelated line
+        summary = statements.setdefault(
+            key, {"statement": key, "count": 0, "total_ms": 0.0, "max_ms": 0.0, "routes": set(), "plan": None}
+        )
+        summary["count"] += 1
+        summary["total_ms"] += record["duration_ms"]
+        summary["max_ms"] = max(summary["max_ms"], record["duration_ms"])
+        if record.get("route"):
+            summary["routes"].add(f'{record["method"]} {record["route"]}')
+        if record.get("plan") is not None:
+            summary["plan"] = record["plan"]
+    worst = sorted(statements.values(), key=lambda summary: summary["total_ms"], reverse=True)[:top]
+    for summary in worst:
+        summary["mean_ms"] = summary["total_ms"] / summary["count"]
+        summary["routes"] = sorted(summary["routes"])
+    return worst
@@ -0,0 +1,80 @@
+"""
+Server Timing
+
+This module adds a Server-Timing header to every response when the
+SERVER_TIMING config is on. It splits the time spent on a request into
+database statements (and how many ran), serialization, the rest of the
+application, and the total, which browser devtools and the load balancer
+logs can show directly. Use timed() around the code to count as
+serialization
+"""
+import time
+from contextlib import contextmanager
+from flask import g, has_request_context
+from sqlalchemy import event
+
+
+def current_timing():
+    """Returns the timings of the current request, or None when they are not being taken"""
+    return g.get("server_timing") if has_request_context() else None
+
+
+@contextmanager
+def timed(name: str):
+    """Adds the time spent in the block to a timing of the current request"""
+    timing = current_timing()
+    if timing is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing[name] = timing.get(name, 0.0) + time.perf_counter() - start
+
+
+def format_header(timing: dict, total: float) -> str:
+    """Formats the timings in seconds as a Server-Timing header in milliseconds"""
+    other = total - timing["db"] - timing.get("serialize", 0.0)
+    queries = "1 query" if timing["queries"] == 1 else f'{timing["queries"]} queries'
+    metrics = [f'db;dur={timing["db"] * 1000:.3f};desc="{queries}"']
+    if "serialize" in timing:
+        metrics.append(f'serialize;dur={timing["serialize"] * 1000:.3f}')
+    metrics.append(f"app;dur={max(other, 0.0) * 1000:.3f}")
+    metrics.append(f"total;dur={total * 1000:.3f}")
+    return ", ".join(metrics)
+
+
+def init_timing(app, engine):
+    """Times the requests of the Flask app and the statements run on the SQLAlchemy engine"""
+
+    @app.before_request
+    def start_timing():
+        if app.config.get("SERVER_TIMING"):
+            g.server_timing = {"start": time.perf_counter(), "db": 0.0, "queries": 0}
+
+    @app.after_request
+    def add_server_timing(response):
+        timing = g.pop("server_timing", None)
+        if timing is not None:
+            response.headers["Server-Timing"] = format_header(timing, time.perf_counter() - timing["start"])
+        return response
+
+    time_statements(engine)
+
+
+def time_statements(engine):
+    """Adds the statements run on a SQLAlchemy engine to the timings of the current request"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def start_statement_timing(_conn, _cursor, _statement, _parameters, context, _executemany):
+        if current_timing() is not None:
+            context.timing_start = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def add_statement_timing(_conn, _cursor, _statement, _parameters, context, _executemany):
+        start = getattr(context, "timing_start", None)
+        timing = current_timing()
+        if start is not None and timing is not None:
+            timing["db"] += time.perf_counter() - start
+            timing["queries"] += 1
@@ -2,6 +2,7 @@
 Global Configuration for Application
 """
 import os
+from service.common.pool import TimedQueuePool
 
 # Get configuration from environment
 DATABASE_URI = os.getenv(
@@ -12,5 +13,67 @@ DATABASE_URI = os.getenv(
 SQLALCHEMY_DATABASE_URI = DATABASE_URI
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 
+# Read replicas for the SELECTs of GET and HEAD requests, comma separated, see service.common.replicas
+DATABASE_REPLICA_URIS = [uri.strip() for uri in os.getenv("DATABASE_REPLICA_URIS", "").split(",") if uri.strip()]
+SQLALCHEMY_BINDS = {f"replica{index}": uri for index, uri in enumerate(DATABASE_REPLICA_URIS)}
+
+# Seconds that a replica which failed to connect is left out before it is tried again
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", "30"))
+
+# Create missing tables when the app starts, otherwise run flask db-migrate first
+DB_CREATE_TABLES = os.getenv("DB_CREATE_TABLES", "false").lower() == "true"
+
+# Connection pool of each worker process, SQLite keeps the SQLAlchemy defaults
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+SQLALCHEMY_ENGINE_OPTIONS = {} if DATABASE_URI.startswith("sqlite") else {
+    "poolclass": TimedQueuePool,
+    "pool_size": DB_POOL_SIZE,
+    "max_overflow": DB_MAX_OVERFLOW,
+    "pool_timeout": DB_POOL_TIMEOUT,
+    "pool_recycle": DB_POOL_RECYCLE,
+    "pool_pre_ping": DB_POOL_PRE_PING,
+}
+
+# Number of Promotions on a page of GET /promotions when no limit is sent, at most 1000
+DEFAULT_PAGE_SIZE = int(os.getenv("DEFAULT_PAGE_SIZE", "100"))
+
+# Number of rows sent in each INSERT by the batch create endpoint
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "500"))
+
+# Size and time to live in seconds of the cache in front of Promotion.find
+PROMOTION_CACHE_SIZE = int(os.getenv("PROMOTION_CACHE_SIZE", "1024"))
+PROMOTION_CACHE_TTL = float(os.getenv("PROMOTION_CACHE_TTL", "30"))
+
+# Similarity a name needs to match a search by trigrams, and seconds before the
+# in-process name index used on databases without pg_trgm is rebuilt, see Promotion.search
+PROMOTION_SEARCH_THRESHOLD = float(os.getenv("PROMOTION_SEARCH_THRESHOLD", "0.3"))
+PROMOTION_SEARCH_INDEX_TTL = float(os.getenv("PROMOTION_SEARCH_INDEX_TTL", "300"))
+
+# Evict Promotions changed by other workers using PostgreSQL LISTEN/NOTIFY
+PROMOTION_CHANGE_LISTENER = os.getenv("PROMOTION_CHANGE_LISTENER", "true").lower() == "true"
+
+# Read GET /promotions/stats from the trigger maintained summary table on PostgreSQL. flask db-migrate
+# installs the triggers while this is on and drops them while it is off
+PROMOTION_STATS_SUMMARY = os.getenv("PROMOTION_STATS_SUMMARY", "false").lower() == "true"
+
+# Send a Server-Timing header with the database, serialization and total time of each request
+SERVER_TIMING = os.getenv("SERVER_TIMING", "false").lower() == "true"
+
+# Log statements slower than this many milliseconds as JSON lines, negative (the default) turns it off.
+# They go to the SLOW_QUERY_LOG file when it is set, otherwise to the app log on stderr
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "-1"))
+SLOW_QUERY_LOG = os.getenv("SLOW_QUERY_LOG", "")
+# Share of the slow SELECTs that are run again under EXPLAIN (ANALYZE, BUFFERS) on PostgreSQL. The
+# EXPLAIN runs inside the request and about doubles its time, so keep it low and only while profiling
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0"))
+
+# Threads that run the Flask app for the requests the ASGI entry point passes on, see service.asgi
+ASGI_WSGI_THREADS = int(os.getenv("ASGI_WSGI_THREADS", "10"))
+
 # Secret for session management
 SECRET_KEY = os.getenv("SECRET_KEY", "s3cr3t-key-shhhh")
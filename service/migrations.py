@@ -0,0 +1,318 @@
+"""
+Schema Migrations
+
+Versioned changes to the database schema that db.create_all() cannot make
+to a table that already exists. Each Migration is applied once, in order,
+and recorded in the schema_version table. Run them with:
+
+    flask db-migrate
+
+Every step is idempotent so a migration that failed half way can simply be
+run again. On PostgreSQL indexes are built with CREATE INDEX CONCURRENTLY so
+a live table is not locked against writes while they are built.
+"""
+import logging
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from sqlalchemy import MetaData, Table, Column, Index, Boolean, Integer, String, DateTime, select, func, inspect, text
+from sqlalchemy.schema import CreateIndex
+from service.models import Promotion, promotion_stats
+
+logger = logging.getLogger("flask.app")
+
+# Key of the PostgreSQL advisory lock that upgrade() holds while it migrates
+MIGRATION_LOCK_KEY = 2820
+
+Migration = namedtuple("Migration", ["version", "description", "upgrade"])
+
+metadata = MetaData()
+
+schema_version = Table(
+    "schema_version",
+    metadata,
+    Column("version", Integer, primary_key=True),
+    Column("description", String(255), nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+# A copy of the promotion table in its own MetaData that the indexes of each
+# migration are defined on, so a migration always builds exactly the indexes
+# it was written with whatever the model has now, and db.create_all() never
+# builds them. An index added to the model needs a new migration.
+promotion = Table(
+    "promotion",
+    MetaData(),
+    Column("name", String(63)),
+    Column("category", String(63)),
+    Column("available", Boolean()),
+)
+
+
+######################################################################
+# Migration steps
+######################################################################
+def create_index(connection, index):
+    """Builds an index if it does not exist, concurrently on PostgreSQL"""
+    if connection.dialect.name != "postgresql":
+        connection.execute(CreateIndex(index, if_not_exists=True))
+        return
+    # a failed CREATE INDEX CONCURRENTLY leaves an invalid index behind
+    invalid = connection.execute(
+        text(
+            "SELECT 1 FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid "
+            "WHERE pg_class.relname = :name AND NOT pg_index.indisvalid"
+        ),
+        {"name": index.name},
+    ).first()
+    if invalid:
+        logger.warning("Dropping invalid index %s", index.name)
+        connection.execute(text(f'DROP INDEX CONCURRENTLY IF EXISTS "{index.name}"'))
+    options = index.dialect_options["postgresql"]
+    options["concurrently"] = True
+    try:
+        connection.execute(CreateIndex(index, if_not_exists=True))
+    finally:
+        options["concurrently"] = False
+
+
+# The indexes for the find_by_* queries, the same as Promotion.__table_args__
+PROMOTION_INDEXES = [
+    Index("ix_promotion_available", promotion.c.available,
+          postgresql_where=promotion.c.available, sqlite_where=promotion.c.available),
+    Index("ix_promotion_category", promotion.c.category),
+    Index("ix_promotion_category_available", promotion.c.category, promotion.c.available),
+    Index("ix_promotion_name", promotion.c.name),
+]
+
+
+def add_promotion_indexes(connection):
+    """Migration 1: index the columns used by the find_by_* queries"""
+    for index in PROMOTION_INDEXES:
+        create_index(connection, index)
+
+
+def add_column(connection, column):
+    """Adds a column to its table if the table does not have it yet"""
+    table = column.table
+    if column.name in {existing["name"] for existing in inspect(connection).get_columns(table.name)}:
+        return
+    ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(connection.dialect)}"
+    if column.server_default is not None:
+        ddl += f" DEFAULT {column.server_default.arg}"
+    if not column.nullable:
+        ddl += " NOT NULL"
+    connection.execute(text(ddl))
+
+
+def add_promotion_version(connection):
+    """Migration 2: add the version column used for ETags"""
+    add_column(connection, Promotion.__table__.c.version)
+
+
+# Statement level triggers that apply the net change of each INSERT, UPDATE or
+# DELETE on promotion to promotion_stats, one upsert per group per statement.
+# Each write waits for the rows of the groups it touches, which are locked in
+# one order so that concurrent writes cannot deadlock on them. They are only
+# installed while PROMOTION_STATS_SUMMARY is on, see set_stats_summary().
+PROMOTION_STATS_TRIGGERS = """
+CREATE OR REPLACE FUNCTION promotion_stats_refresh() RETURNS trigger LANGUAGE plpgsql AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM 1 FROM promotion_stats
+        WHERE (category, promotype, available) IN (SELECT category, promotype::text, available FROM new_rows)
+        ORDER BY category, promotype, available FOR UPDATE;
+    ELSIF TG_OP = 'UPDATE' THEN
+        PERFORM 1 FROM promotion_stats
+        WHERE (category, promotype, available) IN (
+            SELECT category, promotype::text, available FROM new_rows
+            UNION SELECT category, promotype::text, available FROM old_rows
+        )
+        ORDER BY category, promotype, available FOR UPDATE;
+    ELSE
+        PERFORM 1 FROM promotion_stats
+        WHERE (category, promotype, available) IN (SELECT category, promotype::text, available FROM old_rows)
+        ORDER BY category, promotype, available FOR UPDATE;
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO promotion_stats (category, promotype, available, count)
+        SELECT category, promotype::text, available, count(*) FROM new_rows GROUP BY 1, 2, 3 ORDER BY 1, 2, 3
+        ON CONFLICT (category, promotype, available)
+        DO UPDATE SET count = promotion_stats.count + EXCLUDED.count;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE promotion_stats SET count = promotion_stats.count - removed.count
+        FROM (
+            SELECT category, promotype::text AS promotype, available, count(*) AS count
+            FROM old_rows GROUP BY 1, 2, 3
+        ) AS removed
+        WHERE promotion_stats.category = removed.category
+          AND promotion_stats.promotype = removed.promotype
+          AND promotion_stats.available = removed.available;
+    END IF;
+    RETURN NULL;
+END
+$$;
+DROP TRIGGER IF EXISTS promotion_stats_insert ON promotion;
+CREATE TRIGGER promotion_stats_insert AFTER INSERT ON promotion
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE promotion_stats_refresh();
+DROP TRIGGER IF EXISTS promotion_stats_update ON promotion;
+CREATE TRIGGER promotion_stats_update AFTER UPDATE ON promotion
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE promotion_stats_refresh();
+DROP TRIGGER IF EXISTS promotion_stats_delete ON promotion;
+CREATE TRIGGER promotion_stats_delete AFTER DELETE ON promotion
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE promotion_stats_refresh();
+"""
+
+PROMOTION_STATS_DROP_TRIGGERS = """
+DROP TRIGGER IF EXISTS promotion_stats_insert ON promotion;
+DROP TRIGGER IF EXISTS promotion_stats_update ON promotion;
+DROP TRIGGER IF EXISTS promotion_stats_delete ON promotion;
+DROP FUNCTION IF EXISTS promotion_stats_refresh();
+"""
+
+
+def add_promotion_stats(connection):
+    """Migration 3: add the promotion_stats summary table, filled by set_stats_summary()"""
+    if connection.dialect.name != "postgresql":
+        logger.info("Skipping promotion_stats, it needs PostgreSQL triggers")
+        return
+    promotion_stats.create(connection, checkfirst=True)
+
+
+def set_stats_summary(engine, enabled: bool) -> bool:
+    """Installs the promotion_stats triggers when the summary is enabled and drops them when it is not
+
+    The triggers add work to every write, so they only exist while
+    PROMOTION_STATS_SUMMARY is on. Turning it on fills the table from
+    scratch, turning it off leaves the table to go stale until then.
+
+    :param engine: the SQLAlchemy engine of the database
+    :param enabled: True to maintain promotion_stats
+    :type enabled: bool
+
+    :return: True when the triggers are installed
+    :rtype: bool
+
+    """
+    if engine.dialect.name != "postgresql" or not inspect(engine).has_table(promotion_stats.name):
+        return False
+    with migration_lock(engine), engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        installed = connection.execute(
+            text("SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgname = 'promotion_stats_insert')")
+        ).scalar()
+        if not enabled:
+            if installed:
+                logger.info("Dropping the promotion_stats triggers")
+                connection.exec_driver_sql(f"BEGIN;{PROMOTION_STATS_DROP_TRIGGERS}COMMIT;")
+            return False
+        if not installed:
+            logger.info("Installing the promotion_stats triggers")
+            # writes wait while the triggers are installed and the table is filled so no change is missed
+            connection.exec_driver_sql(
+                "BEGIN;"
+                "LOCK TABLE promotion IN SHARE ROW EXCLUSIVE MODE;"
+                f"{PROMOTION_STATS_TRIGGERS}"
+                "DELETE FROM promotion_stats;"
+                "INSERT INTO promotion_stats (category, promotype, available, count) "
+                "SELECT category, promotype::text, available, count(*) FROM promotion GROUP BY 1, 2, 3;"
+                "COMMIT;"
+            )
+    return True
+
+
+# The trigram index behind Promotion.search(), which is not in the model so that
+# db.create_all() never tries to build it without pg_trgm
+name_trigram_index = Index(
+    "ix_promotion_name_trgm",
+    promotion.c.name,
+    postgresql_using="gin",
+    postgresql_ops={"name": "gin_trgm_ops"},
+)
+
+
+def add_name_search(connection):
+    """Migration 4: add the pg_trgm index used to search promotion names"""
+    if connection.dialect.name != "postgresql":
+        logger.info("Skipping the trigram index, search uses an in-process index without PostgreSQL")
+        return
+    connection.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+    create_index(connection, name_trigram_index)
+
+
+# All of the migrations in the order they must be applied
+MIGRATIONS = [
+    Migration(1, "Index category, name and available on promotion", add_promotion_indexes),
+    Migration(2, "Add version to promotion", add_promotion_version),
+    Migration(3, "Add the promotion_stats summary table", add_promotion_stats),
+    Migration(4, "Add a trigram index on promotion name for search", add_name_search),
+]
+
+
+######################################################################
+# Migration runner
+######################################################################
+def current_version(engine) -> int:
+    """Returns the version of the last migration applied to the database"""
+    if not inspect(engine).has_table(schema_version.name):
+        return 0
+    with engine.connect() as connection:
+        version = connection.execute(select(schema_version.c.version).order_by(schema_version.c.version.desc())).first()
+    return version[0] if version else 0
+
+
+def upgrade(engine, target: int = None) -> list:
+    """Applies every migration newer than the current schema version
+
+    :param engine: the SQLAlchemy engine of the database to migrate
+    :param target: the version to stop at, or None for the latest
+    :type target: int
+
+    :return: the versions that were applied
+    :rtype: list
+
+    """
+    with migration_lock(engine):
+        metadata.create_all(engine)
+        Promotion.__table__.create(engine, checkfirst=True)
+        version = current_version(engine)
+        applied = []
+        for migration in MIGRATIONS:
+            if migration.version <= version or (target is not None and migration.version > target):
+                continue
+            logger.info("Applying migration %d: %s", migration.version, migration.description)
+            # autocommit so that indexes can be built concurrently outside of a transaction
+            with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+                migration.upgrade(connection)
+                connection.execute(
+                    schema_version.insert().values(
+                        version=migration.version,
+                        description=migration.description,
+                        applied_at=datetime.utcnow(),
+                    )
+                )
+            applied.append(migration.version)
+    return applied
+
+
+@contextmanager
+def migration_lock(engine):
+    """Lets one upgrade() at a time run against a PostgreSQL database
+
+    Every pod of a deployment migrates before it starts, see
+    deploy/deployment.yaml, so the ones that start together wait here and
+    then find nothing left to apply. The lock is held outside of a
+    transaction, which CREATE INDEX CONCURRENTLY would wait on forever.
+    """
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        connection.execute(select(func.pg_advisory_lock(MIGRATION_LOCK_KEY)))
+        try:
+            yield
+        finally:
+            connection.execute(select(func.pg_advisory_unlock(MIGRATION_LOCK_KEY)))
@@ -11,6 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+# pylint: disable=too-many-lines
 
 """
 Models for Promotion Demo Service
@@ -28,15 +29,56 @@ category (string) - the category the promotion belongs to (i.e., dog, cat)
 available (boolean) - True for promotions that are available for adoption
 
 """
+import json
+import base64
 import logging
 from enum import Enum
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import MetaData, tuple_, literal, insert, update, select, func, type_coerce, text, or_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import make_transient_to_detached
+from sqlalchemy.orm.exc import StaleDataError
+from service.common.cache import LRUCache
+from service.common.explain import Explain, plan_rows
+from service.common.listener import ChangeListener
+from service.common.replicas import ReplicaSet, RoutingSession, replica_request
+from service.common.search import NameIndex, MIN_FUZZY_LENGTH
 
 logger = logging.getLogger("flask.app")
 
+# Read replicas for the SELECTs of GET and HEAD requests, configured in init_app()
+replicas = ReplicaSet()
+
 # Create the SQLAlchemy object to be initialized later in init_db()
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={"class_": RoutingSession, "replicas": replicas})
+
+# Cache of Promotion rows by id in front of Promotion.find(), sized in init_db()
+cache = LRUCache()
+
+# Index of Promotion names for search() on databases without pg_trgm, sized in init_db()
+name_index = NameIndex()
+
+# Prefix of the SQLALCHEMY_BINDS keys of the read replicas, see service.config
+REPLICA_BIND_PREFIX = "replica"
+
+# PostgreSQL channel that carries the ids of changed Promotions to every worker
+CHANGE_CHANNEL = "promotion_changes"
+
+# Background thread that evicts Promotions changed by other workers, see start_listener()
+listener = None  # pylint: disable=invalid-name
+
+# Number of Promotions in each group kept up to date by PostgreSQL triggers. It is
+# created by service.migrations rather than db.create_all() because nothing keeps
+# it current without the triggers, see Promotion.stats()
+promotion_stats = db.Table(
+    "promotion_stats",
+    MetaData(),
+    db.Column("category", db.String(63), primary_key=True),
+    db.Column("promotype", db.String(63), primary_key=True),
+    db.Column("available", db.Boolean(), primary_key=True),
+    db.Column("count", db.BigInteger, nullable=False),
+)
 
 
 def init_db(app):
@@ -44,6 +86,17 @@ def init_db(app):
     Promotion.init_db(app)
 
 
+def init_app(app):
+    """Initialize the SQLAlchemy app without connecting to the database"""
+    Promotion.init_app(app)
+
+
+def reset_session_routing(_error=None):
+    """Sends the next request of this session to a replica again, see service.common.replicas"""
+    if db.session.registry.has():
+        db.session().reset_routing()
+
+
 class DatabaseConnectionError(Exception):
     """Custom Exception when database connection fails"""
 
@@ -52,6 +105,10 @@ class DataValidationError(Exception):
     """Used for an data validation errors when deserializing"""
 
 
+class VersionConflictError(Exception):
+    """Used when a Promotion changed after the version that was read"""
+
+
 class Promotype(Enum):
     """Enumeration of valid Promotion Promotypes"""
 
@@ -60,7 +117,7 @@ class Promotype(Enum):
     UNKNOWN = 3
 
 
-class Promotion(db.Model):
+class Promotion(db.Model):  # pylint: disable=too-many-public-methods
     """
     Class that represents a Promotion
 
@@ -78,6 +135,46 @@ class Promotion(db.Model):
     promotype = db.Column(
         db.Enum(Promotype), nullable=False, server_default=(Promotype.UNKNOWN.name)
     )
+    # Incremented by SQLAlchemy on every UPDATE, used for ETags
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    __mapper_args__ = {"version_id_col": version}
+
+    # Columns that have no default and must be set before a Promotion is saved
+    REQUIRED = ("name", "category")
+
+    # Indexes for the find_by_* queries, existing databases get them from service.migrations
+    __table_args__ = (
+        db.Index("ix_promotion_category", "category"),
+        db.Index("ix_promotion_name", "name"),
+        db.Index(
+            "ix_promotion_available",
+            "available",
+            postgresql_where=available,
+            sqlite_where=available,
+        ),
+        db.Index("ix_promotion_category_available", "category", "available"),
+    )
+
+    # Columns that can be used to sort and paginate a list of Promotions, with
+    # the JSON type of their values in a cursor
+    SORT_KEYS = ("id", "name", "category", "available", "promotype")
+    CURSOR_TYPES = {"id": int, "name": str, "category": str, "available": bool, "promotype": str}
+
+    # Columns returned by the read-only projection, see project()
+    READ_COLUMNS = ("id", "name", "category", "available", "promotype")
+
+    # Columns that stats() groups by
+    STATS_KEYS = ("category", "promotype", "available")
+
+    # True to read stats() from the promotion_stats table, set from the config in init_db()
+    stats_summary = False
+
+    # Number of Promotions that search() returns when no limit is given
+    SEARCH_LIMIT = 20
+
+    # True when search() can use pg_trgm, checked on the first search, see trigram_search()
+    has_trigrams = None
 
     ##################################################
     # INSTANCE METHODS
@@ -96,22 +193,50 @@ class Promotion(db.Model):
         # id must be none to generate next primary key
         self.id = None  # pylint: disable=invalid-name
         db.session.add(self)
+        db.session.flush()
+        self.notify_change(self.id)
         db.session.commit()
+        self.invalidate(self.id)
 
     def update(self):
         """
         Updates a Promotion to the database
+
+        The UPDATE only matches the version that was read, so a Promotion
+        that was changed by someone else in the meantime is not overwritten
         """
         logger.info("Saving %s", self.name)
         if not self.id:
             raise DataValidationError("Update called with empty ID field")
-        db.session.commit()
+        self._commit_change()
 
     def delete(self):
         """Removes a Promotion from the data store"""
         logger.info("Deleting %s", self.name)
         db.session.delete(self)
-        db.session.commit()
+        self._commit_change()
+
+    def refresh(self):
+        """Reloads a Promotion from the database instead of the cache"""
+        self.invalidate(self.id)
+        db.session.refresh(self)
+
+    def _commit_change(self):
+        """Commits a change to this Promotion and evicts it from the caches"""
+        promotion_id = self.id
+        # the values we just wrote are current, so skip reloading them after the commit
+        session = db.session()
+        expire_on_commit = session.expire_on_commit
+        session.expire_on_commit = False
+        try:
+            self.notify_change(promotion_id)
+            session.commit()
+        except StaleDataError as error:
+            session.rollback()
+            raise VersionConflictError(f"Promotion with id '{promotion_id}' was changed by another request") from error
+        finally:
+            session.expire_on_commit = expire_on_commit
+            self.invalidate(promotion_id)
 
     def serialize(self) -> dict:
         """Serializes a Promotion into a dictionary"""
@@ -154,10 +279,175 @@ class Promotion(db.Model):
             ) from error
         return self
 
+    def validate(self):
+        """
+        Checks that the columns without a default are set before the Promotion is saved
+        """
+        for key in self.REQUIRED:
+            if getattr(self, key) is None:
+                raise DataValidationError(f"{key} attribute is not set")
+        return self
+
     ##################################################
     # CLASS METHODS
     ##################################################
 
+    @classmethod
+    def create_many(cls, promotions: list, chunk_size: int = 500, atomic: bool = False) -> int:
+        """Creates many Promotions with one multi-row INSERT per chunk
+
+        Each chunk is sent as a single ``INSERT ... VALUES ... RETURNING id``
+        and the new ids are written back to the Promotions in order. When
+        ``atomic`` is False every chunk runs in its own savepoint, and a chunk
+        that fails is inserted again one row at a time, so only the
+        Promotions that fail are left without an id and the others are
+        still committed. When ``atomic`` is True any failure rolls back the
+        whole batch.
+
+        :param promotions: the Promotions to create
+        :type promotions: list
+        :param chunk_size: the number of rows sent in each INSERT
+        :type chunk_size: int
+        :param atomic: True to create all of the Promotions or none of them
+        :type atomic: bool
+
+        :return: the number of Promotions that were created
+        :rtype: int
+
+        """
+        for promotion in promotions:
+            promotion.validate()
+        logger.info("Creating %d Promotions in chunks of %d", len(promotions), chunk_size)
+        created = 0
+        try:
+            for start in range(0, len(promotions), chunk_size):
+                chunk = promotions[start:start + chunk_size]
+                if atomic:
+                    ids = cls._insert_chunk(chunk)
+                else:
+                    try:
+                        with db.session.begin_nested():
+                            ids = cls._insert_chunk(chunk)
+                    except SQLAlchemyError as error:
+                        logger.error("Could not create chunk at %d, retrying one at a time: %s", start, error)
+                        ids = cls._insert_each(chunk)
+                for promotion, new_id in zip(chunk, ids):
+                    promotion.id = new_id
+                ids = [new_id for new_id in ids if new_id is not None]
+                created += len(ids)
+                cls.notify_change(*ids)
+            db.session.commit()
+            cls.invalidate(*(promotion.id for promotion in promotions if promotion.id is not None))
+        except SQLAlchemyError as error:
+            db.session.rollback()
+            for promotion in promotions:
+                promotion.id = None
+            raise DataValidationError("Invalid promotions: " + str(error)) from error
+        return created
+
+    @classmethod
+    def set_availability(cls, available: bool, ids: list = None, **filters) -> list:
+        """Sets the availability of every matching Promotion in one statement
+
+        Runs a single ``UPDATE ... SET available = ... WHERE ... RETURNING id``
+        that only touches the rows whose availability actually changes.
+
+        :param available: True to activate the Promotions, False to deactivate them
+        :type available: bool
+        :param ids: the ids of the Promotions to change
+        :type ids: list
+        :param filters: name, category and/or promotype to match, see build_filters
+
+        :return: the ids of the Promotions that were changed
+        :rtype: list
+
+        """
+        clauses = cls.build_filters(ids=ids, **filters)
+        if not clauses:
+            raise DataValidationError("Invalid request: ids or a filter are required")
+        logger.info("Setting available to %s for %s", available, filters or ids)
+        statement = (
+            update(cls)
+            .where(cls.available != available, *clauses)
+            .values(available=available, version=cls.version + 1)
+            .returning(cls.id)
+            .execution_options(synchronize_session="fetch")
+        )
+        changed = db.session.execute(statement).scalars().all()
+        cls.notify_change(*changed)
+        db.session.commit()
+        cls.invalidate(*changed)
+        return changed
+
+    @classmethod
+    def build_filters(cls, **filters) -> list:
+        """Returns the WHERE clauses that match every one of the given filters
+
+        Each filter may be a single value or a list of values to match any of.
+
+        :param name: the name(s) of the Promotions to match
+        :param name_prefix: the start of the name of the Promotions to match
+        :type name_prefix: str
+        :param category: the category(ies) of the Promotions to match
+        :param promotype: the Promotype(s) of the Promotions to match
+        :param available: True or False to match the availability
+        :type available: bool
+        :param ids: the ids of the Promotions to match
+        :type ids: list
+
+        :return: a list of SQL expressions to AND together
+        :rtype: list
+
+        """
+        clauses = []
+        for key, value in filters.items():
+            if value is None:
+                continue
+            if key == "name_prefix":
+                clauses.append(cls.name.startswith(value, autoescape=True))
+            elif key == "ids":
+                clauses.append(cls.id.in_(value))
+            elif key in ("name", "category", "promotype", "available"):
+                column = getattr(cls, key)
+                if not isinstance(value, (list, tuple)):
+                    clauses.append(column == value)
+                elif len(value) == 1:
+                    clauses.append(column == value[0])
+                else:
+                    clauses.append(column.in_(value))
+            else:
+                raise DataValidationError(f"Invalid filter: {key}")
+        return clauses
+
+    @classmethod
+    def _insert_chunk(cls, chunk: list) -> list:
+        """Inserts a chunk of Promotions and returns their new ids in order"""
+        table = cls.__table__
+        rows = [
+            {
+                "name": promotion.name,
+                "category": promotion.category,
+                "available": promotion.available,
+                "promotype": promotion.promotype,
+            }
+            for promotion in chunk
+        ]
+        statement = insert(table).values(rows).returning(table.c.id)
+        return db.session.execute(statement).scalars().all()
+
+    @classmethod
+    def _insert_each(cls, chunk: list) -> list:
+        """Inserts a chunk of Promotions one at a time and returns their new ids, or None for the ones that failed"""
+        ids = []
+        for promotion in chunk:
+            try:
+                with db.session.begin_nested():
+                    ids.extend(cls._insert_chunk([promotion]))
+            except SQLAlchemyError as error:
+                logger.error("Could not create %s: %s", promotion.name, error)
+                ids.append(None)
+        return ids
+
     @classmethod
     def init_db(cls, app: Flask):
         """Initializes the database session
@@ -165,12 +455,52 @@ class Promotion(db.Model):
         :param app: the Flask app
         :type data: Flask
 
+        """
+        cls.init_app(app)
+        db.create_all()  # make our sqlalchemy tables
+        cls.start_listener(app)
+
+    @classmethod
+    def init_app(cls, app: Flask):
+        """Initializes the database session without opening a connection
+
+        :param app: the Flask app
+        :type data: Flask
+
         """
         logger.info("Initializing database")
-        # This is where we initialize SQLAlchemy from the Flask app
-        db.init_app(app)
+        # This is where we initialize SQLAlchemy from the Flask app, once
+        if "sqlalchemy" not in app.extensions:
+            db.init_app(app)
+            app.teardown_request(reset_session_routing)
+        cache.configure(app.config.get("PROMOTION_CACHE_SIZE"), app.config.get("PROMOTION_CACHE_TTL"))
+        name_index.configure(app.config.get("PROMOTION_SEARCH_THRESHOLD"), app.config.get("PROMOTION_SEARCH_INDEX_TTL"))
+        cls.has_trigrams = None
         app.app_context().push()
-        db.create_all()  # make our sqlalchemy tables
+        cls.stats_summary = bool(app.config.get("PROMOTION_STATS_SUMMARY")) and db.engine.dialect.name == "postgresql"
+        replicas.configure(
+            [db.engines[key] for key in app.config.get("SQLALCHEMY_BINDS") or {} if key.startswith(REPLICA_BIND_PREFIX)],
+            app.config.get("REPLICA_RETRY_SECONDS"),
+        )
+
+    @classmethod
+    def start_listener(cls, app: Flask):
+        """Starts the thread that evicts Promotions changed by other workers
+
+        :param app: the Flask app
+        :type data: Flask
+
+        """
+        global listener  # pylint: disable=global-statement
+        # the thread of a listener inherited through fork() is not running
+        if (listener is not None and listener.is_alive()) or not app.config.get("PROMOTION_CHANGE_LISTENER", True):
+            return
+        if db.engine.dialect.name != "postgresql":
+            logger.info("Change listener needs PostgreSQL, caches are local to this worker")
+            return
+        listener = ChangeListener(db.engine, CHANGE_CHANNEL)
+        listener.subscribe(cls.evict)
+        listener.start()
 
     @classmethod
     def all(cls) -> list:
@@ -179,18 +509,129 @@ class Promotion(db.Model):
         return cls.query.all()
 
     @classmethod
-    def find(cls, promotion_id: int):
+    def find(cls, promotion_id: int, use_cache: bool = True):
         """Finds a Promotion by it's ID
 
+        Rows that were found recently are served from the cache without a
+        database round trip until they change or their TTL runs out
+
         :param promotion_id: the id of the Promotion to find
         :type promotion_id: int
+        :param use_cache: False to read the row from the database even when it is cached
+        :type use_cache: bool
 
         :return: an instance with the promotion_id, or None if not found
         :rtype: Promotion
 
         """
         logger.info("Processing lookup for id %s ...", promotion_id)
-        return cls.query.get(promotion_id)
+        try:
+            promotion_id = int(promotion_id)
+        except (TypeError, ValueError):
+            return None
+        data = cls.cached(promotion_id) if use_cache else None
+        if data is not None:
+            # attach a copy of the cached row to the session without a query
+            promotion = cls(**data)
+            make_transient_to_detached(promotion)
+            return db.session.merge(promotion, load=False)
+        promotion = cls.query.get(promotion_id)
+        if promotion and not db.session().reads_from_replica():
+            cls.remember(promotion)
+        return promotion
+
+    @staticmethod
+    def cached(promotion_id: int):
+        """Returns the cached row of a Promotion, or None when it is not cached
+
+        Requests that have to read from the primary while there are read
+        replicas, see service.common.replicas, always miss the cache
+
+        :param promotion_id: the id of the Promotion
+        :type promotion_id: int
+
+        :return: the columns of the row by name
+        :rtype: dict
+
+        """
+        if replicas and not replica_request():
+            return None
+        return cache.get(promotion_id)
+
+    @classmethod
+    def remember(cls, promotion):
+        """Keeps a copy of the row of a Promotion that was just read from the primary in the cache
+
+        :param promotion: the Promotion loaded from the database
+        :type promotion: Promotion
+
+        """
+        cache.set(promotion.id, {column.key: getattr(promotion, column.key) for column in cls.__table__.columns})
+
+    @classmethod
+    def find_version(cls, promotion_id: int):
+        """Returns the version of a Promotion without loading the whole row
+
+        :param promotion_id: the id of the Promotion
+        :type promotion_id: int
+
+        :return: the version from the cache or the database, or None if not found
+        :rtype: int
+
+        """
+        try:
+            promotion_id = int(promotion_id)
+        except (TypeError, ValueError):
+            return None
+        data = cls.cached(promotion_id)
+        if data is not None:
+            return data["version"]
+        return db.session.execute(select(cls.version).where(cls.id == promotion_id)).scalar()
+
+    @staticmethod
+    def invalidate(*promotion_ids):
+        """Removes Promotions from the cache and the name index after they change
+
+        :param promotion_ids: the ids of the Promotions that changed
+
+        """
+        promotion_ids = [int(promotion_id) for promotion_id in promotion_ids]
+        cache.delete(*promotion_ids)
+        if promotion_ids:
+            name_index.invalidate(*promotion_ids)
+
+    @staticmethod
+    def notify_change(*promotion_ids, chunk_size: int = 500):
+        """Tells the other workers which Promotions changed
+
+        Sends a NOTIFY on CHANGE_CHANNEL as part of the current transaction, so
+        it is only delivered if the transaction commits. Does nothing unless
+        the database is PostgreSQL.
+
+        :param promotion_ids: the ids of the Promotions that changed
+
+        """
+        if not promotion_ids or db.session.get_bind().dialect.name != "postgresql":
+            return
+        # NOTIFY payloads must be shorter than 8000 bytes
+        for start in range(0, len(promotion_ids), chunk_size):
+            payload = ",".join(str(promotion_id) for promotion_id in promotion_ids[start:start + chunk_size])
+            db.session.execute(select(func.pg_notify(CHANGE_CHANNEL, payload)))
+
+    @staticmethod
+    def evict(promotion_ids):
+        """Evicts Promotions that changed in another worker from the local cache
+
+        :param promotion_ids: the ids that changed, or None if everything may have changed
+        :type promotion_ids: list
+
+        """
+        if promotion_ids is None:
+            cache.clear()
+            name_index.invalidate()
+        else:
+            cache.delete(*promotion_ids)
+            name_index.invalidate(*promotion_ids)
 
     @classmethod
     def find_or_404(cls, promotion_id: int):
@@ -206,6 +647,20 @@ class Promotion(db.Model):
         logger.info("Processing lookup or 404 for id %s ...", promotion_id)
         return cls.query.get_or_404(promotion_id)
 
+    @classmethod
+    def find_by_filters(cls, **filters):
+        """Returns all Promotions that match every one of the filters
+
+        All of the filters are compiled into a single WHERE clause so the
+        database does the filtering, see build_filters for the names
+
+        :return: a collection of Promotions that match
+        :rtype: list
+
+        """
+        logger.info("Processing filter query for %s ...", filters)
+        return cls.query.filter(*cls.build_filters(**filters))
+
     @classmethod
     def find_by_name(cls, name: str) -> list:
         """Returns all Promotions with the given name
@@ -261,3 +716,367 @@ class Promotion(db.Model):
         """
         logger.info("Processing promotype query for %s ...", promotype.name)
         return cls.query.filter(cls.promotype == promotype)
+
+    ##################################################
+    # SEARCH
+    ##################################################
+
+    @classmethod
+    def search(cls, term: str, limit: int = None, columns=None, **filters) -> list:
+        """Returns the Promotions whose names best match a type-ahead search
+
+        A name matches when it starts with the term or, for terms of at least
+        MIN_FUZZY_LENGTH characters, when it contains the term or is similar
+        to it by trigrams, at least PROMOTION_SEARCH_THRESHOLD similar. Prefix
+        matches are ranked first, then the rest by similarity. On PostgreSQL
+        with pg_trgm this is served by the trigram index from
+        service.migrations, anywhere else by the in-process name_index, which
+        is kept up to date through invalidate().
+
+        :param term: what to search for, case insensitive
+        :type term: str
+        :param limit: the maximum number of Promotions to return, or None for SEARCH_LIMIT
+        :type limit: int
+        :param columns: the names of the columns to select, see read_columns
+        :type columns: list
+        :param filters: name, category, promotype and/or available to match, see build_filters
+
+        :return: the matching Promotions as read-only rows, best match first
+        :rtype: list
+
+        """
+        limit = limit or cls.SEARCH_LIMIT
+        logger.info("Processing search for %r ...", term)
+        if not cls.trigram_search():
+            return cls._search_name_index(term, limit, columns, **filters)
+        prefix = cls.name.istartswith(term, autoescape=True)
+        matches = [prefix]
+        if len(term) >= MIN_FUZZY_LENGTH:
+            matches += [cls.name.icontains(term, autoescape=True), cls.name.op("%")(term)]
+        statement = (
+            select(*cls.read_columns(columns))
+            .where(or_(*matches), *cls.build_filters(**filters))
+            .order_by(prefix.desc(), func.similarity(cls.name, term).desc(), func.lower(cls.name), cls.id)
+            .limit(limit)
+        )
+        # % matches by pg_trgm.similarity_threshold, set for this transaction like name_index.threshold
+        db.session.execute(select(func.set_config("pg_trgm.similarity_threshold", str(name_index.threshold), True)))
+        return db.session.execute(statement).all()
+
+    @classmethod
+    def _search_name_index(cls, term: str, limit: int, columns=None, chunk_size: int = 500, **filters) -> list:
+        """Runs search() through name_index and loads the best matches that pass the filters"""
+        name_index.refresh(cls._load_names)
+        ranked = name_index.search(term)
+        entities = cls.read_columns(columns)
+        clauses = cls.build_filters(**filters)
+        # without filters every match is a result, so one chunk of limit ids is enough
+        chunk_size = chunk_size if clauses else limit
+        results = []
+        for start in range(0, len(ranked), chunk_size):
+            ids = ranked[start:start + chunk_size]
+            found = {row.id: row for row in db.session.execute(select(*entities).where(cls.id.in_(ids), *clauses))}
+            results.extend(found[promotion_id] for promotion_id in ids if promotion_id in found)
+            if len(results) >= limit:
+                break
+        return results[:limit]
+
+    @classmethod
+    def trigram_search(cls) -> bool:
+        """Returns True when the database has the pg_trgm extension for search()"""
+        if cls.has_trigrams is None:
+            cls.has_trigrams = db.engine.dialect.name == "postgresql" and bool(
+                db.session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+            )
+        return cls.has_trigrams
+
+    @classmethod
+    def _load_names(cls, ids=None) -> list:
+        """Returns the (id, name) of the Promotions with the ids, or of all of them, for name_index"""
+        statement = select(cls.id, cls.name)
+        if ids is not None:
+            statement = statement.where(cls.id.in_(ids))
+        # from the primary, a replica could hand back names older than the index
+        return db.session.execute(statement, bind_arguments={"bind": db.engine}).all()
+
+    ##################################################
+    # COUNTING
+    ##################################################
+
+    @classmethod
+    def count(cls, query=None, estimate: bool = False) -> int:
+        """Returns the number of Promotions that a query matches
+
+        With estimate=True on PostgreSQL the number comes from the planner
+        statistics instead of a COUNT(*) scan, see estimate_count. Anywhere
+        else, or when there are no statistics, the count is exact.
+
+        :param query: a query from one of the finders, or None for all Promotions
+        :param estimate: True to use the planner estimate when there is one
+        :type estimate: bool
+
+        :return: the number of matching Promotions
+        :rtype: int
+
+        """
+        query = cls.query if query is None else query
+        if estimate and db.engine.dialect.name == "postgresql":
+            rows = cls.estimate_count(query)
+            if rows is not None:
+                return rows
+        logger.info("Processing count query ...")
+        return query.with_entities(func.count(cls.id)).order_by(None).scalar()
+
+    @classmethod
+    def estimate_count(cls, query=None):
+        """Returns the planner estimate of the number of Promotions a query matches
+
+        The whole table is estimated from pg_class.reltuples, which ANALYZE
+        and autovacuum keep up to date. A filtered query is estimated from
+        the row count of its EXPLAIN plan. Only works on PostgreSQL.
+
+        :param query: a query from one of the finders, or None for all Promotions
+
+        :return: the estimated number of Promotions, or None if the table has no statistics yet
+        :rtype: int
+
+        """
+        query = cls.query if query is None else query
+        if query.whereclause is None:
+            logger.info("Processing estimated count of %s ...", cls.__tablename__)
+            reltuples = db.session.execute(
+                text("SELECT reltuples FROM pg_class WHERE oid = CAST(:name AS regclass)"),
+                {"name": cls.__tablename__},
+            ).scalar()
+            # reltuples is -1 (0 before PostgreSQL 14) until the table is first analyzed
+            return int(reltuples) if reltuples and reltuples > 0 else None
+        logger.info("Processing estimated count query ...")
+        statement = query.with_entities(cls.id).order_by(None).statement
+        return plan_rows(db.session.execute(Explain(statement)).scalar())
+
+    @classmethod
+    def stats(cls, **filters) -> list:
+        """Returns the number of Promotions in each (category, promotype, available) group
+
+        The groups are counted with GROUP BY in the database, or read from the
+        promotion_stats summary table when it is enabled and every filter is
+        on one of the STATS_KEYS, so the cost is the number of groups rather
+        than the number of rows. Takes the same filters as build_filters.
+
+        :return: one mapping per group with category, promotype (by name), available and count
+        :rtype: list
+
+        """
+        return db.session.execute(cls.stats_statement(**filters)).mappings().all()
+
+    @classmethod
+    def stats_statement(cls, **filters):
+        """Returns the SELECT that stats() runs, ordered by STATS_KEYS"""
+        if cls.stats_summary and set(filters).issubset(cls.STATS_KEYS):
+            logger.info("Processing stats query on %s for %s ...", promotion_stats.name, filters)
+            clauses = []
+            for key, value in filters.items():
+                if value is None:
+                    continue
+                values = value if isinstance(value, (list, tuple)) else [value]
+                clauses.append(promotion_stats.c[key].in_([getattr(item, "name", item) for item in values]))
+            statement = select(promotion_stats).where(promotion_stats.c["count"] > 0, *clauses)
+        else:
+            logger.info("Processing stats query for %s ...", filters)
+            statement = (
+                select(
+                    cls.category,
+                    type_coerce(cls.promotype, db.String).label("promotype"),
+                    cls.available,
+                    func.count(cls.id).label("count"),
+                )
+                .where(*cls.build_filters(**filters))
+                .group_by(cls.category, cls.promotype, cls.available)
+            )
+        order = [statement.selected_columns[key] for key in cls.STATS_KEYS]
+        return statement.order_by(*order)
+
+    ##################################################
+    # PAGINATION
+    ##################################################
+
+    @classmethod
+    def paginate(cls, query=None, sort: str = "id", limit: int = None, cursor: str = None):
+        """Returns one page of Promotions using keyset (seek) pagination
+
+        Rows are ordered by ``(sort_key, id)`` and the next page starts right
+        after the last row of the previous one, so the database never has
+        to skip over rows that were already returned.
+
+        :param query: a query from one of the finders, or None for all Promotions
+        :param sort: one of SORT_KEYS, prefixed with "-" for descending order
+        :type sort: str
+        :param limit: the maximum number of Promotions to return, or None for all
+        :type limit: int
+        :param cursor: the opaque cursor returned with the previous page
+        :type cursor: str
+
+        :return: the Promotions on this page and the cursor for the next page
+        :rtype: tuple
+
+        """
+        logger.info("Processing page query sorted by %s ...", sort)
+        query, key = cls.seek(query, sort, cursor)
+        if limit is None:
+            return query.all(), None
+        # fetch one extra row to find out if there is another page
+        return cls.next_page(query.limit(limit + 1).all(), limit, key)
+
+    @classmethod
+    def next_page(cls, promotions: list, limit: int, key: str) -> tuple:
+        """Trims the extra row fetched after a page and returns the page and the next cursor
+
+        :param promotions: up to limit + 1 Promotions in order
+        :type promotions: list
+        :param limit: the size of the page
+        :type limit: int
+        :param key: the name of the sort key
+        :type key: str
+
+        :return: the Promotions on this page and the cursor for the next page, or None on the last page
+        :rtype: tuple
+
+        """
+        if len(promotions) <= limit:
+            return promotions, None
+        promotions = promotions[:limit]
+        return promotions, cls.encode_cursor(promotions[-1], key)
+
+    @classmethod
+    def stream(cls, query=None, sort: str = "id", limit: int = None, cursor: str = None, batch_size: int = 500):
+        """Returns a query that streams Promotions through a server-side cursor
+
+        Rows are fetched from the database ``batch_size`` at a time while the
+        caller iterates, so memory use does not grow with the result size.
+
+        :param query: a query from one of the finders, or None for all Promotions
+        :param sort: one of SORT_KEYS, prefixed with "-" for descending order
+        :type sort: str
+        :param limit: the maximum number of Promotions to return, or None for all
+        :type limit: int
+        :param cursor: the opaque cursor returned with a previous page
+        :type cursor: str
+        :param batch_size: the number of rows to fetch per round trip
+        :type batch_size: int
+
+        :return: an iterable of Promotions
+        :rtype: Query
+
+        """
+        query, _ = cls.seek(query, sort, cursor)
+        logger.info("Processing streaming query sorted by %s ...", sort)
+        if limit is not None:
+            query = query.limit(limit)
+        return query.yield_per(batch_size)
+
+    @classmethod
+    def project(cls, query=None, columns=None):
+        """Selects only some columns of the Promotions as read-only rows
+
+        The rows are lightweight named tuples rather than Promotion instances,
+        so loading them skips the identity map and attribute instrumentation.
+        promotype is returned as the name of the Promotype, not the enum.
+        The id is always included. The result can still be passed to
+        paginate() or stream() as long as it has the sort column.
+
+        :param query: a query from one of the finders, or None for all Promotions
+        :param columns: the names of the columns to select, or None for READ_COLUMNS
+        :type columns: list
+
+        :return: a query of rows
+        :rtype: Query
+
+        """
+        query = cls.query if query is None else query
+        return query.with_entities(*cls.read_columns(columns))
+
+    @classmethod
+    def read_columns(cls, columns=None) -> list:
+        """Returns the column expressions that project() selects
+
+        :param columns: the names of the columns to select, or None for READ_COLUMNS
+        :type columns: list
+
+        :return: the id column followed by the other columns, with promotype as its name
+        :rtype: list
+
+        """
+        names = ["id"]
+        for name in columns or cls.READ_COLUMNS:
+            if name not in names:
+                names.append(name)
+        entities = []
+        for name in names:
+            if name not in cls.READ_COLUMNS:
+                raise DataValidationError(f"Invalid column: {name}")
+            column = getattr(cls, name)
+            if name == "promotype":
+                column = type_coerce(column, db.String).label(name)
+            entities.append(column)
+        return entities
+
+    @classmethod
+    def seek(cls, query=None, sort: str = "id", cursor: str = None) -> tuple:
+        """Orders a query by ``(sort_key, id)`` and seeks past the cursor
+
+        :return: the ordered query and the name of the sort key
+        :rtype: tuple
+
+        """
+        descending = sort.startswith("-")
+        key = sort.lstrip("-")
+        if key not in cls.SORT_KEYS:
+            raise DataValidationError(f"Invalid sort key: {key}")
+        column = getattr(cls, key)
+        query = cls.query if query is None else query
+
+        # seek past the last row of the previous page
+        if cursor:
+            value, last_id = cls.decode_cursor(cursor, key)
+            value = literal(value, column.type)
+            if key == "id":
+                seek = (cls.id < last_id) if descending else (cls.id > last_id)
+            elif descending:
+                seek = tuple_(column, cls.id) < tuple_(value, last_id)
+            else:
+                seek = tuple_(column, cls.id) > tuple_(value, last_id)
+            query = query.filter(seek)
+
+        order = [column, cls.id] if key != "id" else [cls.id]
+        if descending:
+            order = [item.desc() for item in order]
+        return query.order_by(*order), key
+
+    @staticmethod
+    def encode_cursor(promotion, key: str) -> str:
+        """Encodes the position of a Promotion as an opaque cursor"""
+        value = getattr(promotion, key)
+        if isinstance(value, Promotype):
+            value = value.name
+        payload = json.dumps([key, value, promotion.id]).encode("utf-8")
+        return base64.urlsafe_b64encode(payload).decode("ascii")
+
+    @classmethod
+    def decode_cursor(cls, cursor: str, key: str) -> tuple:
+        """Decodes a cursor into the (sort value, id) it points at"""
+        try:
+            cursor_key, value, last_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+            if cursor_key != key or not cls._is_json_type(last_id, int):
+                raise ValueError("cursor does not match the sort key")
+            if not cls._is_json_type(value, cls.CURSOR_TYPES[key]):
+                raise ValueError("cursor value does not match the type of the sort key")
+            if key == "promotype":
+                value = Promotype[value]
+        except (ValueError, TypeError, KeyError, UnicodeError) as error:
+            raise DataValidationError("Invalid cursor: " + cursor) from error
+        return value, last_id
+
+    @staticmethod
+    def _is_json_type(value, expected: type) -> bool:
+        """Returns True when a decoded JSON value is of the expected type, where a bool is not an int"""
+        return isinstance(value, expected) and (expected is bool or not isinstance(value, bool))
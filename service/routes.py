@@ -4,16 +4,32 @@ My Service
 Describe what your service does here
 """
 
-# pylint: disable=wrong-import-position
-from functools import wraps
-from flask import jsonify, request, abort  # noqa: F401, E402
-from flask_restx import Resource, fields, reqparse, inputs  # noqa: F401, E402
+# pylint: disable=wrong-import-position, too-many-lines
+import zlib
+from functools import wraps, lru_cache
+from operator import attrgetter
+from flask import jsonify, request, abort, Response, stream_with_context, make_response  # noqa: F401, E402
+from flask_restx import Resource, fields, reqparse, inputs, marshal  # noqa: F401, E402
+from werkzeug.http import quote_etag
 from service.common import status  # HTTP Status Codes
-from service.models import Promotion, Promotype
+from service.common import metrics
+from service.common.timing import timed
+from service.common.serializer import compile_serializer, dumps
+from service.common.pool import pool_stats
+from service.models import Promotion, Promotype, DataValidationError, cache, db, replicas
 from . import app, api
 
 # Import Flask application
 
+# Largest page that can be requested with the limit query parameter
+MAX_PAGE_SIZE = 1000
+
+# Largest number of Promotions that can be sent to the batch create endpoint
+MAX_BATCH_SIZE = 10000
+
+# Media type for streaming a list as newline delimited JSON
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
 
 ######################################################################
 # GET INDEX
@@ -45,12 +61,132 @@ promotion_model = api.inherit(
     }
 )
 
+# Serializes a Promotion exactly like marshal(promotion.serialize(), promotion_model) in one pass
+serialize_promotion = compile_serializer(
+    promotion_model, attributes=True, converters={'promotype': attrgetter('name')}
+)
+# Lists are read as rows from Promotion.project() where promotype is already a name
+serialize_row = compile_serializer(promotion_model, attributes=True)
+
+batch_result_model = api.model('BatchResult', {
+    'index': fields.Integer(description='The position of the Promotion in the posted array'),
+    'status': fields.Integer(description='The HTTP status for this Promotion'),
+    'id': fields.String(description='The id of the created Promotion'),
+    'error': fields.String(description='Why the Promotion was not created'),
+})
+
+batch_model = api.model('BatchResponse', {
+    'created': fields.Integer(description='The number of Promotions created'),
+    'failed': fields.Integer(description='The number of Promotions not created'),
+    'results': fields.List(fields.Nested(batch_result_model, skip_none=True)),
+})
+
+
+######################################################################
+# Sparse fieldsets with the fields query parameter
+######################################################################
+def field_list(value):
+    """ Parses a comma separated list of promotion_model fields into a tuple in model order """
+    names = {name.strip() for name in value.split(',')} - {''}
+    unknown = names.difference(promotion_model.resolved)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    if not names:
+        raise ValueError("At least one field is required")
+    # the same set of fields always gives the same tuple so the serializers below are shared
+    return tuple(key for key in promotion_model.resolved if key in names)
+
+
+field_list.__schema__ = {'type': 'string', 'format': 'comma separated fields'}
+
+
+def search_text(value):
+    """ Parses the text of a name search, which can not be blank """
+    value = value.strip()
+    if not value:
+        raise ValueError("The search text can not be blank")
+    return value
+
+
+search_text.__schema__ = {'type': 'string'}
+
+
+@lru_cache(maxsize=None)
+def promotion_serializer(only=None):
+    """ Returns the compiled serializer for Promotions with only some fields """
+    if only is None:
+        return serialize_promotion
+    return compile_serializer(
+        promotion_model, only=only, attributes=True, converters={'promotype': attrgetter('name')}
+    )
+
+
+@lru_cache(maxsize=None)
+def row_serializer(only=None):
+    """ Returns the compiled serializer for projected rows with only some fields """
+    if only is None:
+        return serialize_row
+    return compile_serializer(promotion_model, only=only, attributes=True)
+
+
+# query string argument that picks the fields to return
+fields_args = reqparse.RequestParser()
+fields_args.add_argument('fields', type=field_list, location='args', required=False,
+                         help='Only return these comma separated fields')
+
+# query string arguments that filter Promotions, repeat one to match any of its values
+filter_args = reqparse.RequestParser()
+filter_args.add_argument('name', type=str, location='args', required=False, action='append',
+                         help='List Promotions by name')
+filter_args.add_argument('name_prefix', type=str, location='args', required=False,
+                         help='List Promotions whose name starts with this text')
+filter_args.add_argument('category', type=str, location='args', required=False, action='append',
+                         help='List Promotions by category')
+filter_args.add_argument('promotype', type=str, location='args', required=False, action='append',
+                         choices=Promotype._member_names_,  # pylint: disable=W0212
+                         help='List Promotions by promotype')
+filter_args.add_argument('available',
+                         type=inputs.boolean, location='args', required=False, help='List Promotions by availability')
+
 # query string arguments
-promotion_args = reqparse.RequestParser()
-promotion_args.add_argument('name', type=str, location='args', required=False, help='List Promotions by name')
-promotion_args.add_argument('category', type=str, location='args', required=False, help='List Promotions by category')
-promotion_args.add_argument('available',
-                            type=inputs.boolean, location='args', required=False, help='List Promotions by availability')
+promotion_args = filter_args.copy()
+promotion_args.add_argument(fields_args.args[0])
+promotion_args.add_argument('sort', type=str, location='args', required=False, default='id',
+                            choices=[prefix + key for key in Promotion.SORT_KEYS for prefix in ('', '-')],
+                            help='Sort Promotions by this field, prefix with - for descending order')
+promotion_args.add_argument('limit', type=inputs.int_range(1, MAX_PAGE_SIZE), location='args', required=False,
+                            help='Maximum number of Promotions to return, DEFAULT_PAGE_SIZE when not sent')
+promotion_args.add_argument('cursor', type=str, location='args', required=False,
+                            help='Cursor from the X-Next-Cursor header of the previous page')
+promotion_args.add_argument('stream', type=inputs.boolean, location='args', required=False, default=False,
+                            help='Stream the list as a chunked JSON array')
+promotion_args.add_argument('q', type=search_text, location='args', required=False,
+                            help='Search names by prefix, substring and similarity, best match first, '
+                                 'returns one page of limit (default 20) Promotions without a cursor')
+promotion_args.add_argument('count', type=inputs.boolean, location='args', required=False, default=False,
+                            help='Send the number of matching Promotions in X-Total-Count')
+# shared with count_args
+estimate_arg = reqparse.Argument('estimate', type=inputs.boolean, location='args', required=False, default=False,
+                                 help='Estimate X-Total-Count from planner statistics instead of counting every row')
+promotion_args.add_argument(estimate_arg)
+
+# query string arguments for counting Promotions
+count_args = filter_args.copy()
+count_args.add_argument(estimate_arg)
+
+
+######################################################################
+# JSON representation using the fastest encoder available
+######################################################################
+@api.representation('application/json')
+def output_json(data, code, headers=None):
+    """ Makes a JSON response with service.common.serializer.dumps """
+    with timed('serialize'):
+        body = dumps(data) + '\n'
+    response = make_response(body, code)
+    response.headers.extend(headers or {})
+    response.mimetype = 'application/json'
+    return response
 
 
 ######################################################################
@@ -78,6 +214,137 @@ def generate_apikey():
     return "133b94898f9b6c07ede6296e0ec197f7"
 
 
+######################################################################
+# Function to turn a Promotion into the body of a response
+######################################################################
+def marshal_promotion(promotion, serializer=serialize_promotion):
+    """ Serializes a Promotion (or a projected row) for a response, honoring an X-Fields mask """
+    mask = request.headers.get('X-Fields')
+    if mask:
+        data = promotion.serialize() if isinstance(promotion, Promotion) else promotion
+        return marshal(data, promotion_model, mask=mask)
+    return serializer(promotion)
+
+
+######################################################################
+# Function to build the ETag of a version of a Promotion
+######################################################################
+def make_etag(promotion_id, version, only=None):
+    """ Returns the (unquoted) strong ETag for a version of a Promotion, or of only some of its fields """
+    etag = f"{promotion_id}-{version}"
+    if only:
+        # a sparse body is a different representation, so it needs a strong ETag of its own
+        etag += f"-{zlib.crc32(','.join(only).encode('utf-8')):08x}"
+    return etag
+
+
+def etag_header(promotion, only=None):
+    """ Returns the ETag response header for the current version of a Promotion """
+    return {'ETag': quote_etag(make_etag(promotion.id, promotion.version, only))}
+
+
+def representation_fields(args):
+    """ Returns the fields a response is limited to, by an X-Fields mask or the fields argument """
+    mask = request.headers.get('X-Fields')
+    return (mask,) if mask else args['fields']
+
+
+######################################################################
+# Functions to find a Promotion to write and check the If-Match header
+######################################################################
+def find_for_write(promotion_id):
+    """ Finds a Promotion to change, from the database unless If-Match names the version to change """
+    # a cached copy may be behind the database, which would fail an unconditional write
+    return Promotion.find(promotion_id, use_cache=bool(request.if_match))
+
+
+def check_if_match(promotion):
+    """ Aborts with 412_PRECONDITION_FAILED unless If-Match names the current version """
+    if not request.if_match:
+        return
+    if not request.if_match.contains(make_etag(promotion.id, promotion.version)):
+        # the cached copy may be behind the database so check the row itself
+        promotion.refresh()
+        if not request.if_match.contains(make_etag(promotion.id, promotion.version)):
+            abort(
+                status.HTTP_412_PRECONDITION_FAILED,
+                f"Promotion with id '{promotion.id}' has changed, its ETag is now "
+                f"{quote_etag(make_etag(promotion.id, promotion.version))}",
+            )
+
+
+######################################################################
+# Function to turn query string arguments into Promotion filters
+######################################################################
+def get_filters(args):
+    """ Returns the filters for Promotion.find_by_filters from parsed arguments """
+    filters = {
+        arg.name: args[arg.name] for arg in filter_args.args if args.get(arg.name) is not None
+    }
+    if 'promotype' in filters:
+        filters['promotype'] = [getattr(Promotype, name) for name in filters['promotype']]
+    return filters
+
+
+######################################################################
+# Function to count the Promotions that a list would return
+######################################################################
+def total_count_header(filters, estimate=False):
+    """ Returns the X-Total-Count header for the Promotions that match the filters """
+    count = Promotion.count(Promotion.find_by_filters(**filters), estimate=estimate)
+    return {'X-Total-Count': str(count)}
+
+
+######################################################################
+# Functions shared by the list of Promotions and the ASGI read path
+######################################################################
+def list_columns(args):
+    """ Returns the columns a list needs, the requested fields plus the sort key for the cursor """
+    if not args['fields']:
+        return None
+    columns = [name for name in args['fields'] if name in Promotion.READ_COLUMNS]
+    columns.append(args['sort'].lstrip('-'))
+    return columns
+
+
+def page_size(args):
+    """ Returns the limit argument, or DEFAULT_PAGE_SIZE capped at MAX_PAGE_SIZE when there is none """
+    return args['limit'] or min(app.config['DEFAULT_PAGE_SIZE'], MAX_PAGE_SIZE)
+
+
+def next_page_headers(next_cursor):
+    """ Returns the X-Next-Cursor and Link headers that point at the next page """
+    # repeated filters such as category=a&category=b keep every value
+    query_string = request.args.to_dict(flat=False)
+    query_string['cursor'] = next_cursor
+    next_url = api.url_for(PromotionCollection, _external=True, **query_string)
+    return {'X-Next-Cursor': next_cursor, 'Link': f'<{next_url}>; rel="next"'}
+
+
+######################################################################
+# Generator that streams a list of Promotions
+######################################################################
+def stream_promotions(promotions, ndjson=False, serializer=serialize_row, chunk_size=100):
+    """ Yields projected Promotion rows as NDJSON lines or as the pieces of a JSON array """
+    separator = '\n' if ndjson else ','
+    chunk = []
+    if not ndjson:
+        yield '['
+    for count, promotion in enumerate(promotions):
+        if count and not ndjson:
+            chunk.append(separator)
+        chunk.append(dumps(serializer(promotion)))
+        if ndjson:
+            chunk.append(separator)
+        # flush every chunk_size rows instead of writing each row on its own
+        if len(chunk) >= 2 * chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+    if not ndjson:
+        chunk.append(']')
+    yield ''.join(chunk)
+
+
 ######################################################################
 #  PATH: /promotions/{id}
 ######################################################################
@@ -97,14 +364,28 @@ class PromotionResource(Resource):
     # RETRIEVE A PROMOTION
     # ------------------------------------------------------------------
     @api.doc('get_promotions')
+    @api.response(200, 'Success', promotion_model, headers={'ETag': 'The version of the Promotion and the fields'})
+    @api.response(304, 'Promotion has not changed since the If-None-Match ETag')
     @api.response(404, 'Promotion not found')
-    @api.marshal_with(promotion_model)
+    @api.header('If-None-Match', 'ETag of the version the client already has')
+    @api.expect(fields_args, validate=True)
     def get(self, promotion_id):
         """
         Retrieve a single Promotion
         This endpoint will return a Promotion based on it's id
         """
         app.logger.info("Request for promotion with id: %s", promotion_id)
+        args = fields_args.parse_args()
+        only = representation_fields(args)
+        if request.if_none_match:
+            # answer from the version alone when the client is up to date
+            version = Promotion.find_version(promotion_id)
+            if version is not None and request.if_none_match.contains_weak(make_etag(promotion_id, version, only)):
+                app.logger.info("Promotion with id %s not modified.", promotion_id)
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+                response.set_etag(make_etag(promotion_id, version, only))
+                return response
+
         promotion = Promotion.find(promotion_id)
         if not promotion:
             abort(
@@ -113,7 +394,9 @@ class PromotionResource(Resource):
             )
 
         app.logger.info("Returning promotion: %s", promotion.name)
-        return promotion.serialize(), status.HTTP_200_OK
+        with timed('serialize'):
+            body = marshal_promotion(promotion, promotion_serializer(args['fields']))
+        return body, status.HTTP_200_OK, etag_header(promotion, only)
 
     # ------------------------------------------------------------------
     # UPDATE AN EXISTING PROMOTION
@@ -121,8 +404,11 @@ class PromotionResource(Resource):
     @api.doc('update_promotions', security='apikey')
     @api.response(404, 'Promotion not found')
     @api.response(400, 'The posted Promotion data was not valid')
+    @api.response(409, 'The Promotion was changed by another request while it was written')
+    @api.response(412, 'The Promotion changed since the If-Match ETag')
+    @api.header('If-Match', 'ETag of the version being updated')
     @api.expect(promotion_model)
-    @api.marshal_with(promotion_model)
+    @api.response(200, 'Success', promotion_model)
     @token_required
     def put(self, promotion_id):
         """
@@ -132,13 +418,15 @@ class PromotionResource(Resource):
         """
         app.logger.info("Request to update promotion with id: %s", promotion_id)
 
-        promotion = Promotion.find(promotion_id)
+        promotion = find_for_write(promotion_id)
         if not promotion:
             abort(
                 status.HTTP_404_NOT_FOUND,
                 f"Promotion with id '{promotion_id}' was not found.",
             )
 
+        check_if_match(promotion)
+
         app.logger.debug('Payload = %s', api.payload)
         data = api.payload
         promotion.deserialize(data)
@@ -146,13 +434,14 @@ class PromotionResource(Resource):
         promotion.update()
 
         app.logger.info("Promotion with ID [%s] updated.", promotion.id)
-        return promotion.serialize(), status.HTTP_200_OK
+        return marshal_promotion(promotion), status.HTTP_200_OK, etag_header(promotion)
 
     # ------------------------------------------------------------------
     # DELETE A PROMOTION
     # ------------------------------------------------------------------
     @api.doc('delete_promotions', security='apikey')
     @api.response(204, 'Promotion deleted')
+    @api.response(409, 'The Promotion was changed by another request while it was deleted')
     @token_required
     def delete(self, promotion_id):
         """
@@ -160,7 +449,7 @@ class PromotionResource(Resource):
         This endpoint will delete a Promotion based on its id
         """
         app.logger.info("Request to delete promotion with id: %s", promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = find_for_write(promotion_id)
         if not promotion:
             return "", status.HTTP_204_NO_CONTENT
         promotion.delete()
@@ -177,34 +466,84 @@ class PromotionCollection(Resource):
     # ------------------------------------------------------------------
     # LIST ALL PROMOTIONS
     # ------------------------------------------------------------------
-    @api.doc('list_promotions')
+    @api.doc('list_promotions', produces=['application/json', NDJSON_MEDIA_TYPE])
     @api.expect(promotion_args, validate=True)
-    @api.marshal_list_with(promotion_model)
+    @api.response(200, 'Success', [promotion_model])
     def get(self):
-        """Returns all of the Promotions"""
+        """Returns the Promotions one page at a time
+
+        Pages hold limit, or DEFAULT_PAGE_SIZE, Promotions and the Link header
+        points at the next one. Send Accept: application/x-ndjson or
+        ?stream=true to stream the whole list, or ?q= to search the names for
+        a type-ahead
+        """
         app.logger.info("Request for Promotion list")
         promotions = []
 
         args = promotion_args.parse_args()
         # Process the query string if any
-        if args['name']:
-            app.logger.info('Filtering by name: %s', args['name'])
-            promotions = Promotion.find_by_name(args['name'])
-        elif args['category']:
-            app.logger.info('Filtering by category: %s', args['category'])
-            promotions = Promotion.find_by_category(args['category'])
-        elif args['available'] is not None:
-            app.logger.info('Filtering by availability: %s', args['available'])
-            promotions = Promotion.find_by_availability(args['available'])
+        filters = get_filters(args)
+        if filters:
+            app.logger.info('Filtering by: %s', filters)
         else:
             app.logger.info('Returning unfiltered list.')
-            promotions = Promotion.all()
+
+        if args['q'] is not None:
+            # search results are ranked by relevance rather than sorted, so there is no next page
+            if args['cursor'] or args['stream'] or args['count']:
+                abort(status.HTTP_400_BAD_REQUEST, 'q can not be combined with cursor, stream or count')
+            promotions = Promotion.search(args['q'], limit=args['limit'], columns=list_columns(args), **filters)
+            serializer = row_serializer(args['fields'])
+            with timed('serialize'):
+                results = [marshal_promotion(promotion, serializer) for promotion in promotions]
+            return results, status.HTTP_200_OK
+
+        # read plain rows instead of Promotions, the list never writes them back
+        promotions = Promotion.project(Promotion.find_by_filters(**filters), list_columns(args))
+        serializer = row_serializer(args['fields'])
+
+        headers = total_count_header(filters, args['estimate']) if args['count'] else {}
+
+        ndjson = request.accept_mimetypes.best_match(['application/json', NDJSON_MEDIA_TYPE]) == NDJSON_MEDIA_TYPE
+        if ndjson or args['stream']:
+            promotions = Promotion.stream(
+                promotions, sort=args['sort'], limit=args['limit'], cursor=args['cursor']
+            )
+            return Response(
+                stream_with_context(stream_promotions(promotions, ndjson, serializer)),
+                status=status.HTTP_200_OK,
+                headers=headers,
+                mimetype=NDJSON_MEDIA_TYPE if ndjson else 'application/json',
+            )
+
+        promotions, next_cursor = Promotion.paginate(
+            promotions, sort=args['sort'], limit=page_size(args), cursor=args['cursor']
+        )
 
         # Return as an array of dictionaries
         # app.logger.info('Promotions returned' + str(promotions))
-        results = [promotion.serialize() for promotion in promotions]
+        with timed('serialize'):
+            results = [marshal_promotion(promotion, serializer) for promotion in promotions]
+
+        if next_cursor:
+            headers.update(next_page_headers(next_cursor))
 
-        return results, status.HTTP_200_OK
+        return results, status.HTTP_200_OK, headers
+
+    # ------------------------------------------------------------------
+    # COUNT PROMOTIONS
+    # ------------------------------------------------------------------
+    @api.doc('count_promotions')
+    @api.expect(count_args, validate=True)
+    @api.response(200, 'Success', headers={'X-Total-Count': 'The number of matching Promotions'})
+    def head(self):
+        """Returns the number of Promotions that GET would list in X-Total-Count"""
+        app.logger.info("Request for Promotion count")
+        args = count_args.parse_args()
+        filters = get_filters(args)
+        headers = total_count_header(filters, args['estimate'])
+        app.logger.info("Counted %s Promotions.", headers['X-Total-Count'])
+        return Response(status=status.HTTP_200_OK, headers=headers)
 
     # ------------------------------------------------------------------
     # ADD A NEW PROMOTION
@@ -212,7 +551,7 @@ class PromotionCollection(Resource):
     @api.doc('create_promotions', security='apikey')
     @api.response(400, 'The posted data was not valid')
     @api.expect(create_model)
-    @api.marshal_with(promotion_model, code=201)
+    @api.response(201, 'Promotion created', promotion_model)
     @token_required
     def post(self):
         """
@@ -228,7 +567,174 @@ class PromotionCollection(Resource):
         location_url = api.url_for(PromotionResource, promotion_id=promotion.id, _external=True)
 
         app.logger.info("Promotion with ID [%s] created.", promotion.id)
-        return promotion.serialize(), status.HTTP_201_CREATED, {'Location': location_url}
+        return marshal_promotion(promotion), status.HTTP_201_CREATED, {'Location': location_url}
+
+
+######################################################################
+#  PATH: /promotions:batch
+######################################################################
+batch_args = reqparse.RequestParser()
+batch_args.add_argument('atomic', type=inputs.boolean, location='args', required=False, default=False,
+                        help='Create all of the Promotions or none of them')
+
+
+@api.route('/promotions:batch')
+class PromotionBatch(Resource):
+    """ Creates many Promotions in one request """
+    @api.doc('create_promotions_batch', security='apikey')
+    @api.response(400, 'The posted data was not valid')
+    @api.response(207, 'Some of the Promotions were not created', batch_model)
+    @api.expect(batch_args, [create_model])
+    @api.marshal_with(batch_model, code=201)
+    @token_required
+    def post(self):
+        """
+        Creates many Promotions
+        This endpoint will create every Promotion in the posted array and report the outcome of each one
+        """
+        app.logger.info("Request to create a batch of promotions")
+        args = batch_args.parse_args()
+        data = api.payload
+        if not isinstance(data, list):
+            raise DataValidationError("Invalid batch: body of request must be a JSON array")
+        if len(data) > MAX_BATCH_SIZE:
+            raise DataValidationError(f"Invalid batch: more than {MAX_BATCH_SIZE} promotions")
+
+        results = []
+        promotions = []
+        for position, item in enumerate(data):
+            try:
+                promotions.append((position, Promotion().deserialize(item).validate()))
+            except DataValidationError as error:
+                results.append({'index': position, 'status': status.HTTP_400_BAD_REQUEST, 'error': str(error)})
+
+        if results and args['atomic']:
+            app.logger.info("Batch rejected with %d invalid promotions.", len(results))
+            return {'created': 0, 'failed': len(data), 'results': results}, status.HTTP_400_BAD_REQUEST
+
+        created = Promotion.create_many(
+            [promotion for _, promotion in promotions], app.config['BATCH_CHUNK_SIZE'], args['atomic']
+        )
+        for position, promotion in promotions:
+            if promotion.id is None:
+                results.append({
+                    'index': position,
+                    'status': status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    'error': 'Promotion could not be saved',
+                })
+            else:
+                results.append({'index': position, 'status': status.HTTP_201_CREATED, 'id': promotion.id})
+        results.sort(key=lambda result: result['index'])
+
+        app.logger.info("Batch created %d of %d promotions.", created, len(data))
+        code = status.HTTP_201_CREATED
+        if created < len(data):
+            code = status.HTTP_207_MULTI_STATUS if created else status.HTTP_400_BAD_REQUEST
+        return {'created': created, 'failed': len(data) - created, 'results': results}, code
+
+
+######################################################################
+#  PATH: /promotions:activate and /promotions:deactivate
+######################################################################
+bulk_args = filter_args.copy()
+bulk_args.remove_argument('available')
+
+bulk_ids_model = api.model('BulkIds', {
+    'ids': fields.List(fields.Integer, description='The ids of the Promotions to change'),
+})
+
+bulk_result_model = api.model('BulkResult', {
+    'updated': fields.Integer(description='The number of Promotions changed'),
+    'ids': fields.List(fields.Integer, description='The ids of the Promotions changed'),
+})
+
+
+def set_availability(available):
+    """ Changes the availability of the Promotions selected by the request """
+    args = bulk_args.parse_args()
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids') if isinstance(data, dict) else None
+    if ids is not None and not (isinstance(ids, list) and all(isinstance(i, int) for i in ids)):
+        raise DataValidationError("Invalid request: ids must be a list of integers")
+    changed = Promotion.set_availability(available, ids, **get_filters(args))
+    return {'updated': len(changed), 'ids': changed}, status.HTTP_200_OK
+
+
+@api.route('/promotions:activate')
+class BulkActivateResource(Resource):
+    """Activate every Promotion that matches the ids or filters"""
+    @api.doc('activate_promotions_bulk', security='apikey')
+    @api.response(400, 'No ids or filters were given')
+    @api.expect(bulk_args, bulk_ids_model)
+    @api.marshal_with(bulk_result_model)
+    @token_required
+    def put(self):
+        """
+        Activate many Promotions
+
+        This endpoint will make every matching Promotion available in one update
+        """
+        app.logger.info("Request to activate promotions in bulk")
+        return set_availability(True)
+
+
+@api.route('/promotions:deactivate')
+class BulkDeactivateResource(Resource):
+    """Deactivate every Promotion that matches the ids or filters"""
+    @api.doc('deactivate_promotions_bulk', security='apikey')
+    @api.response(400, 'No ids or filters were given')
+    @api.expect(bulk_args, bulk_ids_model)
+    @api.marshal_with(bulk_result_model)
+    @token_required
+    def put(self):
+        """
+        Deactivate many Promotions
+
+        This endpoint will make every matching Promotion unavailable in one update
+        """
+        app.logger.info("Request to deactivate promotions in bulk")
+        return set_availability(False)
+
+
+######################################################################
+#  PATH: /promotions/stats
+######################################################################
+stats_group_model = api.model('PromotionStatsGroup', {
+    'category': fields.String(description='The category of the Promotions in this group'),
+    'promotype': fields.String(enum=Promotype._member_names_,  # pylint: disable=W0212
+                               description='The promotype of the Promotions in this group'),
+    'available': fields.Boolean(description='The availability of the Promotions in this group'),
+    'count': fields.Integer(description='The number of Promotions in this group'),
+})
+
+stats_model = api.model('PromotionStats', {
+    'total': fields.Integer(description='The number of Promotions in every group'),
+    'groups': fields.List(fields.Nested(stats_group_model)),
+})
+
+
+def stats_body(groups):
+    """ Returns the body of a stats response for the counted groups """
+    return {'total': sum(group['count'] for group in groups), 'groups': groups}
+
+
+@api.route('/promotions/stats')
+class PromotionStatsResource(Resource):
+    """Counts of Promotions grouped by category, promotype and availability"""
+    @api.doc('get_promotion_stats')
+    @api.expect(filter_args, validate=True)
+    @api.marshal_with(stats_model)
+    def get(self):
+        """
+        Returns Promotion statistics
+
+        This endpoint will count the Promotions that match the filters in each
+        (category, promotype, available) group
+        """
+        app.logger.info("Request for Promotion stats")
+        args = filter_args.parse_args()
+        groups = Promotion.stats(**get_filters(args))
+        return stats_body(groups), status.HTTP_200_OK
 
 
 ######################################################################
@@ -240,6 +746,9 @@ class ActivateResource(Resource):
     """Activate one Promotion by Promotion ID"""
     @api.doc('activate_promotions')
     @api.response(404, 'Promotion not found')
+    @api.response(409, 'The Promotion was changed by another request while it was written')
+    @api.response(412, 'The Promotion changed since the If-Match ETag')
+    @api.header('If-Match', 'ETag of the version being changed')
     # @api.response(409, 'The Promotion is not available for activate')
     def put(self, promotion_id):
         """
@@ -248,16 +757,17 @@ class ActivateResource(Resource):
         This endpoint will activate a Promotion by making it available
         """
         app.logger.info("Request to activate promotion with id: %s", promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = find_for_write(promotion_id)
         if not promotion:
             abort(
                  status.HTTP_404_NOT_FOUND,
                  f"Promotion with id '{promotion_id}' was not found.",
                  )
+        check_if_match(promotion)
         promotion.available = True
         promotion.update()
         app.logger.info("Promotion with ID [%s] activated.", promotion.id)
-        return promotion.serialize(), status.HTTP_200_OK
+        return promotion.serialize(), status.HTTP_200_OK, etag_header(promotion)
 
 
 ######################################################################
@@ -269,6 +779,9 @@ class DeactivateResource(Resource):
     """Activate one Promotion by Promotion ID"""
     @api.doc('activate_promotions')
     @api.response(404, 'Promotion not found')
+    @api.response(409, 'The Promotion was changed by another request while it was written')
+    @api.response(412, 'The Promotion changed since the If-Match ETag')
+    @api.header('If-Match', 'ETag of the version being changed')
     # @api.response(409, 'The Promotion is not available for activate')
     def put(self, promotion_id):
         """
@@ -277,16 +790,17 @@ class DeactivateResource(Resource):
         This endpoint will deactivate a Promotion by making it unavailable
         """
         app.logger.info("Request to deactivate promotion with id: %s", promotion_id)
-        promotion = Promotion.find(promotion_id)
+        promotion = find_for_write(promotion_id)
         if not promotion:
             abort(
                  status.HTTP_404_NOT_FOUND,
                  f"Promotion with id '{promotion_id}' was not found.",
                  )
+        check_if_match(promotion)
         promotion.available = False
         promotion.update()
         app.logger.info("Promotion with ID [%s] deactivated.", promotion.id)
-        return promotion.serialize(), status.HTTP_200_OK
+        return promotion.serialize(), status.HTTP_200_OK, etag_header(promotion)
 
 ######################################################################
 #  R E S T   A P I   E N D P O I N T S
@@ -297,11 +811,26 @@ class DeactivateResource(Resource):
 def health_endpoint():
     """Make a GET request to the /health endpoint of the service"""
     return (
-        jsonify({"status": "OK"}),
+        jsonify({
+            "status": "OK",
+            "cache": cache.stats(),
+            "pool": pool_stats(db.engine.pool),
+            "replicas": replicas.stats(),
+        }),
         status.HTTP_200_OK,
     )
 
 
+######################################################################
+# PROMETHEUS METRICS
+######################################################################
+@app.route("/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Returns the metrics of every worker in the Prometheus text format"""
+    body, content_type = metrics.render()
+    return Response(body, status=status.HTTP_200_OK, content_type=content_type)
+
+
 # ######################################################################
 # # ADD A NEW PROMOTION
 # ######################################################################
@@ -35,3 +35,13 @@ class PromotionFactory(factory.Factory):
     available = FuzzyChoice(choices=[True, False])
     promotype = FuzzyChoice(
         choices=[Promotype.BUYONEGETONEFREE, Promotype.GET20PERCENTOFF, Promotype.UNKNOWN])
+
+
+def disable_change_listener(app):
+    """Keeps an app under test from starting the LISTEN/NOTIFY thread
+
+    The tests see their own changes because the code under test evicts
+    them, and the thread itself is tested with a fake connection in
+    test_listener
+    """
+    app.config["PROMOTION_CHANGE_LISTENER"] = False
@@ -0,0 +1,74 @@
+"""
+Test cases for the LRU Cache
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+from unittest import TestCase
+from service.common.cache import LRUCache
+
+
+class FakeTimer:  # pylint: disable=too-few-public-methods
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+######################################################################
+#  C A C H E   T E S T   C A S E S
+######################################################################
+class TestLRUCache(TestCase):
+    """Test Cases for the LRU Cache"""
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.cache = LRUCache(maxsize=2, ttl=10, timer=self.timer)
+
+    def test_get_and_set(self):
+        """It should return cached values and count hits and misses"""
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.set("a", 1)
+        self.assertEqual(self.cache.get("a"), 1)
+        stats = self.cache.stats()
+        self.assertEqual(stats["hits"], 1)
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["size"], 1)
+
+    def test_evict_least_recently_used(self):
+        """It should evict the least recently used entry when full"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.get("a")
+        self.cache.set("c", 3)
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), 1)
+        self.assertEqual(self.cache.get("c"), 3)
+        self.assertEqual(self.cache.stats()["evictions"], 1)
+
+    def test_expire_after_ttl(self):
+        """It should not return entries older than the TTL"""
+        self.cache.set("a", 1)
+        self.timer.now = 11
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_delete_and_clear(self):
+        """It should delete entries"""
+        self.cache.set("a", 1)
+        self.cache.set("b", 2)
+        self.cache.delete("a", "x")
+        self.assertEqual(len(self.cache), 1)
+        self.cache.clear()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_disabled(self):
+        """It should not store anything when maxsize is 0"""
+        self.cache.configure(maxsize=0, ttl=5)
+        self.cache.set("a", 1)
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(self.cache.ttl, 5)
@@ -2,22 +2,60 @@
 CLI Command Extensions for Flask
 """
 import os
+import json
+import tempfile
 from unittest import TestCase
 from unittest.mock import patch, MagicMock
-from click.testing import CliRunner
-from service.common.cli_commands import db_create
+from service import app
+from service.common.cli_commands import db_create, db_migrate, slow_queries_report
 
 
 class TestFlaskCLI(TestCase):
     """Test Flask CLI Commands"""
 
     def setUp(self):
-        self.runner = CliRunner()
+        self.runner = app.test_cli_runner()
 
     @patch('service.common.cli_commands.db')
     def test_db_create(self, db_mock):
         """It should call the db-create command"""
         db_mock.return_value = MagicMock()
-        with patch.dict(os.environ, {"FLASK_APP": "service:app"}, clear=True):
+        with patch.dict(os.environ, {"FLASK_APP": "service:create_app()"}, clear=True):
             result = self.runner.invoke(db_create)
             self.assertEqual(result.exit_code, 0)
+
+    @patch('service.common.cli_commands.db')
+    @patch('service.common.cli_commands.migrations')
+    def test_db_migrate(self, migrations_mock, db_mock):
+        """It should call the db-migrate command"""
+        migrations_mock.upgrade.return_value = [1]
+        migrations_mock.current_version.return_value = 1
+        with patch.dict(os.environ, {"FLASK_APP": "service:create_app()"}, clear=True):
+            result = self.runner.invoke(db_migrate, ["--target", "1"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("Applied migration 1", result.output)
+            migrations_mock.upgrade.assert_called_once_with(db_mock.engine, 1)
+            migrations_mock.set_stats_summary.assert_called_once_with(
+                db_mock.engine, app.config["PROMOTION_STATS_SUMMARY"]
+            )
+
+    def test_slow_queries(self):
+        """It should summarize the slow query log"""
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, "slow_queries.jsonl")
+            result = self.runner.invoke(slow_queries_report, ["--log", path])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("No slow queries", result.output)
+            with open(path, "w", encoding="utf-8") as log:
+                for duration in (250, 350):
+                    record = {"statement": "SELECT * FROM promotion", "duration_ms": duration,
+                              "route": "/api/promotions", "method": "GET", "plan": [{"Plan": {}}]}
+                    log.write(json.dumps(record) + "\n")
+            result = self.runner.invoke(slow_queries_report, ["--log", path, "--plans"])
+            self.assertEqual(result.exit_code, 0)
+            self.assertIn("1. 2 calls, total 600.0 ms, mean 300.0 ms, max 350.0 ms", result.output)
+            self.assertIn("from GET /api/promotions", result.output)
+            self.assertIn('"Plan"', result.output)
+        with patch.dict(app.config, {"SLOW_QUERY_LOG": ""}):
+            result = self.runner.invoke(slow_queries_report, [])
+        self.assertIn("Pass the log with --log", result.output)
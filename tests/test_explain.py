@@ -0,0 +1,35 @@
+"""
+Test cases for the EXPLAIN construct
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import json
+from unittest import TestCase
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+from service.common.explain import Explain, plan_rows
+from service.models import Promotion
+
+
+######################################################################
+#  E X P L A I N   T E S T   C A S E S
+######################################################################
+class TestExplain(TestCase):
+    """Test Cases for the EXPLAIN construct"""
+
+    def test_compile_explain(self):
+        """It should put EXPLAIN in front of a statement and keep its parameters"""
+        statement = select(Promotion.id).where(Promotion.category == "holiday")
+        compiled = Explain(statement).compile(dialect=postgresql.dialect())
+        self.assertTrue(str(compiled).startswith("EXPLAIN (FORMAT JSON) SELECT promotion.id"))
+        self.assertEqual(list(compiled.params.values()), ["holiday"])
+        compiled = Explain(statement, "ANALYZE, BUFFERS").compile(dialect=postgresql.dialect())
+        self.assertTrue(str(compiled).startswith("EXPLAIN (ANALYZE, BUFFERS) SELECT"))
+
+    def test_plan_rows(self):
+        """It should read the estimated rows from a JSON plan"""
+        plan = [{"Plan": {"Node Type": "Seq Scan", "Plan Rows": 1234}}]
+        self.assertEqual(plan_rows(plan), 1234)
+        self.assertEqual(plan_rows(json.dumps(plan)), 1234)
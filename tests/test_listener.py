@@ -0,0 +1,133 @@
+"""
+Test cases for the Change Listener
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+from types import SimpleNamespace
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from service.common.listener import ChangeListener
+from service.models import Promotion, cache
+
+
+class FakeConnection:  # pylint: disable=too-few-public-methods
+    """A psycopg2 connection that delivers one batch of payloads per poll
+
+    A batch that is an exception is raised instead, like a dropped
+    connection, and the listener is stopped when the batches run out.
+    """
+
+    def __init__(self, listener, batches, on_poll=None):
+        self.listener = listener
+        self.batches = list(batches)
+        self.on_poll = on_poll
+        self.notifies = []
+        self.autocommit = False
+        self.cursor = MagicMock()
+        self.cursor.return_value.__enter__.return_value = self.cursor.return_value
+
+    def poll(self):
+        """Queues the next batch of notifications"""
+        if not self.batches:
+            self.listener.stop()
+            return
+        if self.on_poll:
+            self.on_poll()
+        batch = self.batches.pop(0)
+        if isinstance(batch, Exception):
+            raise batch
+        self.notifies.extend(SimpleNamespace(payload=payload) for payload in batch)
+
+
+def pooled(dbapi_connection):
+    """Wraps a DBAPI connection like Engine.raw_connection does"""
+    return MagicMock(driver_connection=dbapi_connection)
+
+
+######################################################################
+#  L I S T E N E R   T E S T   C A S E S
+######################################################################
+class TestChangeListener(TestCase):
+    """Test Cases for the Change Listener"""
+
+    def setUp(self):
+        self.listener = ChangeListener(MagicMock(), "changes")
+        self.changed = []
+        self.listener.subscribe(self.changed.append)
+
+    def test_dispatch_ids(self):
+        """It should pass the ids in every payload to the callbacks"""
+        self.listener.dispatch(["1,2", "3"])
+        self.assertEqual(self.changed, [[1, 2, 3]])
+
+    def test_dispatch_everything(self):
+        """It should tell the callbacks when everything may have changed"""
+        self.listener.dispatch(None)
+        self.assertEqual(self.changed, [None])
+
+    def test_dispatch_nothing(self):
+        """It should not call the callbacks for empty payloads"""
+        self.listener.dispatch([""])
+        self.assertEqual(self.changed, [])
+
+    def test_callback_error(self):
+        """It should keep calling callbacks after one of them fails"""
+        failing = ChangeListener(MagicMock(), "changes")
+        failing.subscribe(MagicMock(side_effect=ValueError("boom")))
+        failing.subscribe(self.changed.append)
+        failing.dispatch(["7"])
+        self.assertEqual(self.changed, [[7]])
+
+    def test_stop(self):
+        """It should not listen once it is stopped"""
+        self.listener.stop()
+        self.listener.run()
+        self.listener.engine.raw_connection.assert_not_called()
+
+
+######################################################################
+#  L I S T E N   T E S T   C A S E S
+######################################################################
+@patch("service.common.listener.select.select", lambda readable, *_: (readable, [], []))
+class TestListen(TestCase):
+    """Test Cases for listening on a connection"""
+
+    def setUp(self):
+        cache.clear()
+        self.listener = ChangeListener(MagicMock(), "changes", retry=0)
+        self.listener.subscribe(Promotion.evict)
+
+    def tearDown(self):
+        cache.clear()
+
+    def cache_promotions(self):
+        """Caches Promotions 1 to 3 after the listener has connected"""
+        for promotion_id in range(1, 4):
+            cache.set(promotion_id, f"promotion {promotion_id}")
+
+    def test_listen_evicts(self):
+        """It should evict the Promotions named in notifications"""
+        connection = FakeConnection(self.listener, [["1,3"]], on_poll=self.cache_promotions)
+        self.listener.engine.raw_connection.return_value = pooled(connection)
+        self.listener.run()
+        self.assertTrue(connection.autocommit)
+        connection.cursor.return_value.execute.assert_called_once_with('LISTEN "changes"')
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get(2), "promotion 2")
+        self.assertIsNone(cache.get(3))
+        self.listener.engine.raw_connection.return_value.close.assert_called_once()
+
+    def test_listen_reconnects(self):
+        """It should reconnect, and evict everything, after losing its connection"""
+        dropped = FakeConnection(self.listener, [OSError("connection lost")], on_poll=self.cache_promotions)
+        connection = FakeConnection(self.listener, [["2"]])
+        connections = [pooled(dropped), pooled(connection)]
+        self.listener.engine.raw_connection.side_effect = connections
+        self.listener.run()
+        self.assertEqual(self.listener.engine.raw_connection.call_count, 2)
+        for pooled_connection in connections:
+            pooled_connection.close.assert_called_once()
+        # notifications sent while it was reconnecting are lost
+        self.assertEqual(len(cache), 0)
@@ -0,0 +1,90 @@
+"""
+Test cases for the Prometheus Metrics
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+from unittest import TestCase
+from flask import Flask
+from sqlalchemy import create_engine, text
+from prometheus_client.parser import text_string_to_metric_families
+from service.common import metrics, status
+from service.common.cache import LRUCache
+
+
+######################################################################
+#  M E T R I C S   T E S T   C A S E S
+######################################################################
+class TestMetrics(TestCase):
+    """Test Cases for the Prometheus Metrics"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        cls.engine = create_engine("sqlite://")
+        cls.cache = LRUCache()
+        cls.app = Flask(__name__)
+
+        @cls.app.route("/things/<thing_id>")
+        def get_thing(thing_id):
+            with cls.engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+            cls.cache.get(thing_id)
+            return {"id": thing_id}, status.HTTP_200_OK
+
+        @cls.app.route("/metrics")
+        def get_metrics():
+            body, content_type = metrics.render()
+            return body, status.HTTP_200_OK, {"Content-Type": content_type}
+
+        metrics.init_metrics(cls.app, cls.engine, cls.cache)
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        cls.engine.dispose()
+
+    def setUp(self):
+        """This runs before each test"""
+        self.client = self.app.test_client()
+
+    def get_samples(self):
+        """Scrapes /metrics and returns the samples by name"""
+        response = self.client.get("/metrics")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.content_type.startswith("text/plain"))
+        samples = {}
+        for family in text_string_to_metric_families(response.get_data(as_text=True)):
+            for sample in family.samples:
+                samples.setdefault(sample.name, []).append(sample)
+        return samples
+
+    def test_request_latency(self):
+        """It should count requests by route, method and status"""
+        self.client.get("/things/1")
+        self.client.get("/things/2")
+        self.client.get("/nothing")
+        samples = self.get_samples()
+        counts = {
+            (sample.labels["route"], sample.labels["method"], sample.labels["status"]): sample.value
+            for sample in samples["promotions_request_duration_seconds_count"]
+        }
+        self.assertGreaterEqual(counts[("/things/<thing_id>", "GET", "200")], 2)
+        self.assertGreaterEqual(counts[("unmatched", "GET", "404")], 1)
+        # the scrape itself is the only request in flight
+        self.assertEqual(samples["promotions_requests_in_flight"][0].value, 1)
+
+    def test_database_and_cache(self):
+        """It should report database statements and the cache counters"""
+        # the gauges are shared with every app in the process, compare with this cache
+        misses = self.cache.stats()["misses"]
+        self.client.get("/things/3")
+        samples = self.get_samples()
+        selects = [
+            sample.value for sample in samples["promotions_db_query_duration_seconds_count"]
+            if sample.labels["operation"] == "SELECT"
+        ]
+        self.assertEqual(len(selects), 1)
+        self.assertEqual(samples["promotions_cache_misses"][0].value, misses + 1)
+        self.assertIn("promotions_cache_size", samples)
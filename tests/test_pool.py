@@ -0,0 +1,61 @@
+"""
+Test cases for the timed Connection Pool
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+from unittest import TestCase
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool
+from service.common.pool import TimedQueuePool, pool_stats
+
+
+######################################################################
+#  P O O L   T E S T   C A S E S
+######################################################################
+class TestPool(TestCase):
+    """Test Cases for the timed Connection Pool"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.engine = create_engine(
+            "sqlite://", poolclass=TimedQueuePool, pool_size=1, max_overflow=1, pool_timeout=0.05
+        )
+
+    def tearDown(self):
+        """This runs after each test"""
+        self.engine.dispose()
+
+    def test_pool_stats(self):
+        """It should count checked out, idle and overflow connections"""
+        stats = pool_stats(self.engine.pool)
+        self.assertEqual(stats["class"], "TimedQueuePool")
+        self.assertEqual((stats["size"], stats["checked_out"], stats["idle"], stats["overflow"]), (1, 0, 0, 0))
+        first = self.engine.connect()
+        second = self.engine.connect()
+        first.execute(text("SELECT 1"))
+        stats = pool_stats(self.engine.pool)
+        self.assertEqual((stats["checked_out"], stats["idle"], stats["overflow"]), (2, 0, 1))
+        second.close()
+        first.close()
+        stats = pool_stats(self.engine.pool)
+        self.assertEqual(stats["checked_out"], 0)
+        self.assertEqual(stats["checkouts"], 2)
+        self.assertGreaterEqual(stats["wait_max_ms"], stats["wait_avg_ms"])
+
+    def test_pool_timeout(self):
+        """It should count checkouts that time out"""
+        connections = [self.engine.connect(), self.engine.connect()]
+        self.assertRaises(PoolTimeoutError, self.engine.connect)
+        stats = pool_stats(self.engine.pool)
+        self.assertEqual(stats["timeouts"], 1)
+        self.assertGreaterEqual(stats["wait_max_ms"], 50)
+        for connection in connections:
+            connection.close()
+
+    def test_other_pools(self):
+        """It should describe pools that are not QueuePools"""
+        engine = create_engine("sqlite://", poolclass=NullPool)
+        self.assertEqual(pool_stats(engine.pool), {"class": "NullPool"})
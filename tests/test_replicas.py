@@ -0,0 +1,186 @@
+"""
+Test cases for the Read Replica routing
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import os
+import tempfile
+from unittest import TestCase
+from unittest.mock import patch
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, select, text
+from sqlalchemy.exc import OperationalError
+from service.common.replicas import ReplicaSet, RoutingSession
+
+
+class FakeTimer:  # pylint: disable=too-few-public-methods
+    """A clock that only moves when it is told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+######################################################################
+#  R E P L I C A   S E T   T E S T   C A S E S
+######################################################################
+class TestReplicaSet(TestCase):
+    """Test Cases for choosing and ejecting replicas"""
+
+    def setUp(self):
+        """This runs before each test"""
+        self.timer = FakeTimer()
+        self.engines = [create_engine("sqlite://"), create_engine("sqlite://")]
+        self.replicas = ReplicaSet(retry=30.0, timer=self.timer)
+        self.replicas.configure(self.engines)
+
+    def tearDown(self):
+        """This runs after each test"""
+        for engine in self.engines:
+            engine.dispose()
+
+    def test_round_robin(self):
+        """It should take turns between the replicas"""
+        chosen = [self.replicas.choose() for _ in range(4)]
+        self.assertEqual(chosen, self.engines + self.engines)
+        self.assertEqual(len(self.replicas), 2)
+
+    def test_eject(self):
+        """It should leave an ejected replica out until its retry time is up"""
+        self.replicas.eject(0)
+        self.assertEqual([self.replicas.choose() for _ in range(3)], [self.engines[1]] * 3)
+        self.assertEqual([replica["healthy"] for replica in self.replicas.stats()], [False, True])
+        self.replicas.eject(1)
+        self.assertIsNone(self.replicas.choose())
+        self.timer.now += 31
+        self.assertIsNotNone(self.replicas.choose())
+        self.assertEqual([replica["healthy"] for replica in self.replicas.stats()], [True, True])
+
+    def test_eject_on_connection_error(self):
+        """It should eject a replica that cannot be connected to"""
+        broken = create_engine("sqlite:////nonexistent/directory/replica.db")
+        self.replicas.configure([broken] + self.engines)
+        with self.assertRaises(OperationalError):
+            with broken.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        self.assertEqual([replica["healthy"] for replica in self.replicas.stats()], [False, True, True])
+        self.assertNotIn(broken, [self.replicas.choose() for _ in range(4)])
+
+    def test_configure_again(self):
+        """It should watch each engine once however often it is configured"""
+        broken = create_engine("sqlite:////nonexistent/directory/replica.db")
+        for _ in range(3):
+            self.replicas.configure(self.engines + [broken])
+        self.replicas.configure([broken] + self.engines)
+        with patch.object(self.replicas, "eject", wraps=self.replicas.eject) as eject:
+            with self.assertRaises(OperationalError):
+                with broken.connect() as connection:
+                    connection.execute(text("SELECT 1"))
+        eject.assert_called_once()
+        self.assertEqual(eject.call_args[0][0], 0)
+        self.assertEqual([replica["healthy"] for replica in self.replicas.stats()], [False, True, True])
+
+    def test_stats(self):
+        """It should list the replicas with their health"""
+        self.assertEqual(self.replicas.stats(), [{"url": "sqlite://", "healthy": True}] * 2)
+
+
+######################################################################
+#  R O U T I N G   S E S S I O N   T E S T   C A S E S
+######################################################################
+class TestRoutingSession(TestCase):
+    """Test Cases for sending the reads of read-only requests to replicas"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        cls.directory = tempfile.TemporaryDirectory()  # pylint: disable=consider-using-with
+        uris = {name: f"sqlite:///{os.path.join(cls.directory.name, name)}.db" for name in ("primary", "b", "c")}
+        cls.replicas = ReplicaSet()
+        cls.db = SQLAlchemy(session_options={"class_": RoutingSession, "replicas": cls.replicas})
+        cls.app = Flask(__name__)
+        cls.app.config["SQLALCHEMY_DATABASE_URI"] = uris["primary"]
+        cls.app.config["SQLALCHEMY_BINDS"] = {"replica0": uris["b"], "replica1": uris["c"]}
+        cls.db.init_app(cls.app)
+
+        class Thing(cls.db.Model):  # pylint: disable=too-few-public-methods
+            """A row that tells which database it was read from"""
+
+            id = cls.db.Column(cls.db.Integer, primary_key=True)
+            name = cls.db.Column(cls.db.String(63))
+
+        cls.Thing = Thing
+        with cls.app.app_context():
+            # every database has its own copy of the table with a different row
+            for key, name in ((None, "primary"), ("replica0", "b"), ("replica1", "c")):
+                engine = cls.db.engines[key]
+                Thing.metadata.create_all(engine)
+                with engine.begin() as connection:
+                    connection.execute(Thing.__table__.insert().values(name=name))
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        with cls.app.app_context():
+            for engine in cls.db.engines.values():
+                engine.dispose()
+        cls.directory.cleanup()
+
+    def setUp(self):
+        """This runs before each test"""
+        with self.app.app_context():
+            self.replicas.configure([self.db.engines["replica0"], self.db.engines["replica1"]])
+
+    def read(self, method="GET", headers=None):
+        """Returns the name of the database that a request reads from"""
+        with self.app.test_request_context("/", method=method, headers=headers):
+            return self.db.session.execute(select(self.Thing.name)).scalar()
+
+    def test_get_reads_from_replicas(self):
+        """It should take turns between the replicas for GET requests"""
+        self.assertEqual([self.read() for _ in range(4)], ["b", "c", "b", "c"])
+        self.assertIn(self.read("HEAD"), ("b", "c"))
+
+    def test_one_replica_per_request(self):
+        """It should read from one replica for the whole request"""
+        with self.app.test_request_context("/"):
+            names = [self.db.session.execute(select(self.Thing.name)).scalar() for _ in range(3)]
+            self.assertEqual(len(set(names)), 1)
+            self.db.session().reset_routing()
+            self.assertNotEqual(self.db.session.execute(select(self.Thing.name)).scalar(), names[0])
+
+    def test_writes_read_from_primary(self):
+        """It should read from the primary in requests that write"""
+        self.assertEqual(self.read("POST"), "primary")
+        self.assertEqual(self.read("PUT"), "primary")
+
+    def test_consistent_read(self):
+        """It should read from the primary when the request asks for it"""
+        self.assertEqual(self.read(headers={"X-Consistent-Read": "true"}), "primary")
+
+    def test_read_your_writes(self):
+        """It should read from the primary after the request has written"""
+        with self.app.test_request_context("/"):
+            self.db.session.add(self.Thing(name="new"))
+            names = self.db.session.execute(select(self.Thing.name).order_by(self.Thing.id)).scalars().all()
+            self.assertEqual(names, ["primary", "new"])
+            self.db.session.rollback()
+
+    def test_outside_of_requests(self):
+        """It should read from the primary outside of a request"""
+        with self.app.app_context():
+            self.assertEqual(self.db.session.execute(select(self.Thing.name)).scalar(), "primary")
+
+    def test_no_healthy_replicas(self):
+        """It should read from the primary when every replica is ejected"""
+        self.replicas.eject(0)
+        self.replicas.eject(1)
+        self.assertEqual(self.read(), "primary")
+        with self.app.app_context():
+            self.replicas.configure([])
+        self.assertEqual(self.read(), "primary")
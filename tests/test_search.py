@@ -0,0 +1,115 @@
+"""
+Test cases for the Name Search index
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+from unittest import TestCase
+from service.common.search import NameIndex, trigrams, similarity
+
+
+class FakeTimer:  # pylint: disable=too-few-public-methods
+    """A clock that only moves when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeTable:  # pylint: disable=too-few-public-methods
+    """The (id, name) rows that the index loads, counting each load"""
+
+    def __init__(self, names):
+        self.names = dict(enumerate(names, start=1))
+        self.loads = []
+
+    def __call__(self, ids=None):
+        self.loads.append(ids)
+        if ids is None:
+            return list(self.names.items())
+        return [(key, self.names[key]) for key in ids if key in self.names]
+
+
+######################################################################
+#  T R I G R A M   T E S T   C A S E S
+######################################################################
+class TestTrigrams(TestCase):
+    """Test Cases for splitting text into trigrams like pg_trgm"""
+
+    def test_trigrams(self):
+        """It should pad every word and lower case it like show_trgm()"""
+        self.assertEqual(trigrams("Cat"), {"  c", " ca", "cat", "at "})
+        self.assertEqual(trigrams("a-b"), {"  a", " a ", "  b", " b "})
+        self.assertEqual(trigrams(""), set())
+
+    def test_similarity(self):
+        """It should share trigrams over all trigrams like similarity()"""
+        self.assertEqual(similarity(trigrams("cat"), trigrams("cat")), 1.0)
+        self.assertAlmostEqual(similarity(trigrams("cat"), trigrams("cats")), 0.5)
+        self.assertEqual(similarity(set(), set()), 0.0)
+
+
+######################################################################
+#  N A M E   I N D E X   T E S T   C A S E S
+######################################################################
+class TestNameIndex(TestCase):
+    """Test Cases for the in-process Name Index"""
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.table = FakeTable(["Summer Sale", "Sumer Sale", "Winter Sale", "Super Summer", "Su"])
+        self.index = NameIndex(threshold=0.3, ttl=60, timer=self.timer)
+        self.index.refresh(self.table)
+
+    def test_prefix(self):
+        """It should match names that start with the search text, for any length"""
+        # the more of its trigrams a name shares with the text the better it ranks
+        self.assertEqual(self.index.search("su"), [5, 2, 4, 1])
+        self.assertEqual(self.index.search("SUMM")[0], 1)
+        self.assertEqual(self.index.search("x"), [])
+
+    def test_substring_and_fuzzy(self):
+        """It should rank prefix matches first, then substring and similar names"""
+        self.assertEqual(self.index.search("summer"), [1, 4, 2])
+        self.assertEqual(self.index.search("sale"), [2, 1, 3])
+        self.assertEqual(self.index.search("wintr"), [])
+        self.index.configure(threshold=0.25)
+        self.index.refresh(self.table)
+        self.assertEqual(self.index.search("wintr"), [3])
+
+    def test_invalidate(self):
+        """It should reload only the names that changed"""
+        self.table.names[2] = "Autumn Sale"
+        self.table.names[6] = "Summer Camp"
+        del self.table.names[5]
+        self.index.invalidate(2, 5, 6)
+        self.index.refresh(self.table)
+        self.assertEqual(self.table.loads, [None, [2, 5, 6]])
+        self.assertEqual(self.index.search("su"), [4, 1, 6])
+        self.assertEqual(self.index.search("autumn"), [2])
+        self.assertEqual(len(self.index), 5)
+
+    def test_rebuild(self):
+        """It should rebuild the whole index after the TTL or when told to"""
+        self.index.refresh(self.table)
+        self.assertEqual(self.table.loads, [None])
+        self.timer.now = 61
+        self.index.refresh(self.table)
+        self.assertEqual(self.table.loads, [None, None])
+        self.index.invalidate()
+        self.assertEqual(self.index.search("su"), [])
+        self.index.refresh(self.table)
+        self.assertEqual(self.table.loads, [None, None, None])
+
+    def test_not_built(self):
+        """It should ignore changes until it is first built"""
+        index = NameIndex()
+        index.invalidate(1)
+        self.assertEqual(index.search("summer"), [])
+        index.configure(threshold=0.9, ttl=10)
+        index.refresh(self.table)
+        self.assertEqual(index.search("summer"), [1, 4])
+        self.assertEqual(self.table.loads, [None, None])
@@ -0,0 +1,69 @@
+"""
+Test cases for the compiled Serializer
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import json
+from operator import attrgetter
+from unittest import TestCase
+from flask_restx import Model, fields, marshal
+from service.common import serializer
+from service.common.serializer import compile_serializer, dumps
+from service.routes import promotion_model, serialize_promotion
+from tests.factories import PromotionFactory
+
+
+######################################################################
+#  S E R I A L I Z E R   T E S T   C A S E S
+######################################################################
+class TestSerializer(TestCase):
+    """Test Cases for the compiled Serializer"""
+
+    def test_same_as_marshal(self):
+        """It should serialize a Promotion exactly like marshal"""
+        for promotion in PromotionFactory.create_batch(20):
+            expected = marshal(promotion.serialize(), promotion_model)
+            actual = serialize_promotion(promotion)
+            self.assertEqual(actual, expected)
+            self.assertEqual(list(actual), list(expected))
+
+    def test_serialize_dict(self):
+        """It should serialize a dictionary with missing values"""
+        serialize = compile_serializer(promotion_model)
+        data = {"id": 7, "name": "Fido", "available": 1}
+        self.assertEqual(serialize(data), marshal(data, promotion_model))
+
+    def test_only_some_fields(self):
+        """It should serialize only the fields asked for"""
+        serialize = compile_serializer(
+            promotion_model, only=["id", "promotype"], attributes=True,
+            converters={"promotype": attrgetter("name")}
+        )
+        promotion = PromotionFactory()
+        self.assertEqual(serialize(promotion), {"id": str(promotion.id), "promotype": promotion.promotype.name})
+
+    def test_fall_back_to_field(self):
+        """It should use the field itself for fields it cannot compile"""
+        model = Model("Test", {
+            "name": fields.String(default="none"),
+            "label": fields.String(attribute="name"),
+            "tags": fields.List(fields.String),
+            "price": fields.Float,
+            "count": fields.Integer,
+        })
+        serialize = compile_serializer(model)
+        for data in ({"name": "a", "tags": ["x"], "price": "1.5", "count": "3"}, {}):
+            self.assertEqual(serialize(data), marshal(data, model))
+
+    def test_dumps(self):
+        """It should encode JSON with or without orjson"""
+        data = {"id": "1", "available": True, "name": "café"}
+        self.assertEqual(json.loads(dumps(data)), data)
+        backend = serializer.orjson
+        serializer.orjson = None
+        try:
+            self.assertEqual(json.loads(dumps(data)), data)
+        finally:
+            serializer.orjson = backend
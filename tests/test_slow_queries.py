@@ -0,0 +1,137 @@
+"""
+Test cases for the Slow Query Log
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+import json
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+from flask import Flask
+from sqlalchemy import create_engine, text
+from service.common import slow_queries, status
+
+
+######################################################################
+#  S L O W   Q U E R Y   L O G   T E S T   C A S E S
+######################################################################
+class TestSlowQueries(TestCase):
+    """Test Cases for the Slow Query Log"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        cls.engine = create_engine("sqlite://")
+        cls.app = Flask(__name__)
+        # log every statement
+        cls.app.config.update(SLOW_QUERY_MS=0, SLOW_QUERY_LOG=None, SLOW_QUERY_EXPLAIN_SAMPLE=1.0)
+
+        @cls.app.route("/things/<thing_id>")
+        def get_thing(thing_id):
+            with cls.engine.connect() as connection:
+                connection.execute(text("SELECT :id"), {"id": thing_id})
+            return {"id": thing_id}, status.HTTP_200_OK
+
+        slow_queries.init_slow_query_log(cls.app, cls.engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        cls.engine.dispose()
+
+    def test_log_slow_query(self):
+        """It should log a slow statement with its route as JSON"""
+        with self.assertLogs("promotions.slow_queries") as logs:
+            response = self.app.test_client().get("/things/7")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        record = json.loads(logs.records[-1].getMessage())
+        self.assertEqual(record["statement"], "SELECT ?")
+        self.assertEqual(record["parameters"], ["7"])
+        self.assertEqual(record["route"], "/things/<thing_id>")
+        self.assertEqual(record["method"], "GET")
+        self.assertGreaterEqual(record["duration_ms"], 0)
+        # plans are only taken on PostgreSQL
+        self.assertNotIn("plan", record)
+
+    def test_disabled(self):
+        """It should not log anything with a negative threshold"""
+        app = Flask(__name__)
+        app.config["SLOW_QUERY_MS"] = -1
+        engine = create_engine("sqlite://")
+        slow_queries.init_slow_query_log(app, engine)
+        with patch.object(slow_queries.logger, "warning") as warning:
+            with engine.connect() as connection:
+                connection.execute(text("SELECT 1"))
+        warning.assert_not_called()
+
+    def test_explainable(self):
+        """It should only explain plain SELECTs on PostgreSQL"""
+        connection = MagicMock()
+        connection.dialect.name = "postgresql"
+        self.assertTrue(slow_queries.explainable(connection, "SELECT * FROM promotion", False))
+        self.assertFalse(slow_queries.explainable(connection, "SELECT * FROM promotion", True))
+        self.assertFalse(slow_queries.explainable(connection, "UPDATE promotion SET available = true", False))
+        connection.dialect.name = "sqlite"
+        self.assertFalse(slow_queries.explainable(connection, "SELECT * FROM promotion", False))
+
+    def test_explain(self):
+        """It should run EXPLAIN inside a savepoint on a new cursor"""
+        connection = MagicMock()
+        connection.connection.dbapi_connection.autocommit = False
+        cursor = connection.connection.dbapi_connection.cursor.return_value
+        cursor.fetchone.return_value = [[{"Plan": {"Node Type": "Seq Scan"}}]]
+        plan = slow_queries.explain(connection, "SELECT * FROM promotion WHERE id = %(id)s", {"id": 1})
+        self.assertEqual(plan, [{"Plan": {"Node Type": "Seq Scan"}}])
+        statements = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertEqual(statements[0], "SAVEPOINT slow_query_explain")
+        self.assertTrue(statements[1].startswith("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) SELECT"))
+        self.assertEqual(statements[2], "RELEASE SAVEPOINT slow_query_explain")
+        cursor.close.assert_called_once()
+        # a failed EXPLAIN rolls back to the savepoint
+        cursor.reset_mock()
+        cursor.execute.side_effect = [None, RuntimeError("boom"), None]
+        self.assertRaises(RuntimeError, slow_queries.explain, connection, "SELECT 1", {})
+        self.assertEqual(cursor.execute.call_args_list[-1].args[0], "ROLLBACK TO SAVEPOINT slow_query_explain")
+
+    def test_read_only(self):
+        """It should only run SELECTs that only read again under EXPLAIN ANALYZE"""
+        self.assertTrue(slow_queries.read_only("SELECT count(promotion.id) FROM promotion WHERE id IN (%(id)s)"))
+        self.assertTrue(slow_queries.read_only("SELECT * FROM (SELECT name FROM promotion) AS anon_1"))
+        self.assertFalse(slow_queries.read_only("SELECT pg_advisory_lock(%(pg_advisory_lock_1)s)"))
+        self.assertFalse(slow_queries.read_only("SELECT pg_notify(%(channel)s, %(ids)s)"))
+        self.assertFalse(slow_queries.read_only("SELECT set_config(%(name)s, %(value)s, true)"))
+        self.assertFalse(slow_queries.read_only("SELECT * FROM promotion_stats FOR UPDATE"))
+
+    def test_explain_advisory_lock(self):
+        """It should only plan a slow advisory lock SELECT instead of taking the lock again"""
+        connection = MagicMock()
+        connection.connection.dbapi_connection.autocommit = True
+        cursor = connection.connection.dbapi_connection.cursor.return_value
+        cursor.fetchone.return_value = [[{"Plan": {"Node Type": "Result"}}]]
+        slow_queries.explain(connection, "SELECT pg_advisory_lock(%(key)s)", {"key": 2820})
+        statements = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertEqual(statements, ["EXPLAIN (FORMAT JSON) SELECT pg_advisory_lock(%(key)s)"])
+
+    def test_summarize(self):
+        """It should group the log by statement, worst total time first"""
+        lines = [
+            json.dumps({"statement": "SELECT a\n FROM t", "duration_ms": 300, "route": "/x", "method": "GET"}),
+            json.dumps({"statement": "SELECT b FROM t", "duration_ms": 250, "route": None, "method": None}),
+            "",
+            '{"statement": "SELECT a FROM t", "dura',
+            "[2023-04-01 10:00:00 +0000] [WARNING] [slow_queries] "
+            + json.dumps({"statement": "SELECT a FROM t", "duration_ms": 500, "route": "/y", "method": "PUT", "plan": [1]}),
+            json.dumps({"statement": None, "duration_ms": 1}),
+            json.dumps([1, 2]),
+            "[2023-04-01 10:00:00 +0000] [INFO] [routes] Request for Promotion list",
+        ]
+        worst = slow_queries.summarize(lines, top=1)
+        self.assertEqual(len(worst), 1)
+        self.assertEqual(worst[0]["statement"], "SELECT a FROM t")
+        self.assertEqual(worst[0]["count"], 2)
+        self.assertEqual(worst[0]["total_ms"], 800)
+        self.assertEqual(worst[0]["mean_ms"], 400)
+        self.assertEqual(worst[0]["max_ms"], 500)
+        self.assertEqual(worst[0]["routes"], ["GET /x", "PUT /y"])
+        self.assertEqual(worst[0]["plan"], [1])
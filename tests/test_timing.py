@@ -0,0 +1,76 @@
+"""
+Test cases for the Server Timing header
+
+Test cases can be run with:
+    nosetests
+    coverage report -m
+"""
+from unittest import TestCase
+from flask import Flask
+from sqlalchemy import create_engine, text
+from service.common import status, timing
+
+
+######################################################################
+#  S E R V E R   T I M I N G   T E S T   C A S E S
+######################################################################
+class TestServerTiming(TestCase):
+    """Test Cases for the Server Timing header"""
+
+    @classmethod
+    def setUpClass(cls):
+        """This runs once before the entire test suite"""
+        cls.engine = create_engine("sqlite://")
+        cls.app = Flask(__name__)
+
+        @cls.app.route("/things")
+        def list_things():
+            with cls.engine.connect() as connection:
+                rows = connection.execute(text("SELECT 1 UNION ALL SELECT 2")).all()
+                connection.execute(text("SELECT 3"))
+            with timing.timed("serialize"):
+                body = {"things": [row[0] for row in rows]}
+            return body, status.HTTP_200_OK
+
+        timing.init_timing(cls.app, cls.engine)
+
+    @classmethod
+    def tearDownClass(cls):
+        """This runs once after the entire test suite"""
+        cls.engine.dispose()
+
+    def setUp(self):
+        """This runs before each test"""
+        self.app.config["SERVER_TIMING"] = True
+        self.client = self.app.test_client()
+
+    def test_server_timing_header(self):
+        """It should send the database, serialization and total time"""
+        response = self.client.get("/things")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        metrics = {}
+        for metric in response.headers["Server-Timing"].split(", "):
+            name, *params = metric.split(";")
+            metrics[name] = dict(param.split("=", 1) for param in params)
+        self.assertEqual(list(metrics), ["db", "serialize", "app", "total"])
+        self.assertEqual(metrics["db"]["desc"], '"2 queries"')
+        self.assertGreater(float(metrics["total"]["dur"]), float(metrics["db"]["dur"]))
+
+    def test_server_timing_off(self):
+        """It should not time requests when SERVER_TIMING is off"""
+        self.app.config["SERVER_TIMING"] = False
+        response = self.client.get("/things")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotIn("Server-Timing", response.headers)
+
+    def test_timed_outside_request(self):
+        """It should run a timed block outside of a request"""
+        with timing.timed("serialize"):
+            value = 1
+        self.assertEqual(value, 1)
+        self.assertIsNone(timing.current_timing())
+
+    def test_format_header(self):
+        """It should format the timings in milliseconds"""
+        header = timing.format_header({"db": 0.002, "queries": 1}, 0.005)
+        self.assertEqual(header, 'db;dur=2.000;desc="1 query", app;dur=3.000, total;dur=5.000')